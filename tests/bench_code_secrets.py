@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks for the secrets scan of `twigs.code_secrets`.
+
+Generates a synthetic repository and times `scan_for_secrets` under every
+combination of --enable_entropy / --check_common_passwords / --mask_secret.
+Results are appended to a JSON file keyed by the git commit of the tree, so
+runs of different commits can be compared with --compare.
+
+    python -m tests.bench_code_secrets --files 2000 --secret_density 0.01
+    python -m tests.bench_code_secrets --compare <commit>
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import string
+import shutil
+import argparse
+import tempfile
+import itertools
+import subprocess
+import logging
+
+from twigs import code_secrets
+from twigs import code_secrets_defaults as cs_defaults
+
+WORDS = ['import', 'return', 'self', 'value', 'config', 'for', 'if', 'print', 'the', 'data', 'def', 'else']
+EXTENSIONS = ['.py', '.js', '.java', '.yml', '.txt', '.go']
+SCAN_OPTIONS = ['enable_entropy', 'check_common_passwords', 'mask_secret']
+
+
+def random_token(rnd, charset, length):
+    return ''.join([rnd.choice(charset) for i in range(length)])
+
+
+def secret_line(rnd):
+    """Return a line holding a secret found by a regex rule, entropy or a common password."""
+    kind = rnd.randint(0, 3)
+    if kind == 0:
+        return 'aws_key = "AKIA' + random_token(rnd, string.ascii_uppercase + string.digits, 16) + '"'
+    elif kind == 1:
+        return 'token = "' + random_token(rnd, code_secrets.BASE64_CHARACTERS[:-3], 40) + '"'
+    elif kind == 2:
+        return 'checksum = "' + random_token(rnd, code_secrets.HEX_CHARACTERS, 40) + '"'
+    return 'password = "' + rnd.choice(cs_defaults.common_passwords[:1000]) + '"'
+
+
+def code_line(rnd, line_length):
+    words = []
+    length = 0
+    while length < line_length:
+        word = rnd.choice(WORDS)
+        words.append(word)
+        length = length + len(word) + 1
+    return ' ' * rnd.choice([0, 4, 8]) + ' '.join(words)
+
+
+def generate_corpus(path, opts):
+    """Write the synthetic repository under path and return its size in bytes."""
+    rnd = random.Random(opts.seed)
+    total_size = 0
+    for i in range(opts.files):
+        dir_path = os.path.join(path, 'd%d' % (i % opts.dirs), 'sub%d' % (i % 7))
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        dice = rnd.random()
+        if dice < opts.binary_ratio:
+            file_path = os.path.join(dir_path, 'f%d.bin' % i)
+            content = bytes(bytearray(rnd.getrandbits(8) for j in range(opts.lines * opts.line_length)))
+        else:
+            lines = []
+            for j in range(opts.lines):
+                if rnd.random() < opts.secret_density:
+                    lines.append(secret_line(rnd))
+                else:
+                    lines.append(code_line(rnd, opts.line_length))
+            if dice < opts.binary_ratio + opts.minified_ratio:
+                # minified files are a few very long lines
+                file_path = os.path.join(dir_path, 'f%d.min.js' % i)
+                content = ';'.join(lines) + '\n'
+            else:
+                file_path = os.path.join(dir_path, 'f%d%s' % (i, rnd.choice(EXTENSIONS)))
+                content = '\n'.join(lines) + '\n'
+            content = content.encode('latin-1')
+        with open(file_path, 'wb') as fd:
+            fd.write(content)
+        total_size = total_size + len(content)
+    return total_size
+
+
+def scan_args(opts, flags):
+    return argparse.Namespace(enable_entropy=flags['enable_entropy'],
+            check_common_passwords=flags['check_common_passwords'], mask_secret=flags['mask_secret'],
+            no_code=False, encoding='latin-1', regex_rules_file=None, common_passwords_file=None,
+            include_patterns=None, include_patterns_file=None, exclude_patterns=None,
+            exclude_patterns_file=None, secrets_workers=opts.workers, secrets_max_file_size=0,
+            secrets_large_files='skip', secrets_history=False, cache_dir=None, cache_max_age=30,
+            cache_max_size=1024)
+
+
+def get_commit():
+    repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_path).decode('ascii').strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no', 'twigs'], cwd=repo_path)
+    except (subprocess.CalledProcessError, OSError):
+        return 'unknown'
+    return commit + '-dirty' if len(dirty.strip()) > 0 else commit
+
+
+def run_benchmarks(opts):
+    corpus_path = tempfile.mkdtemp(prefix='twigs_bench_')
+    try:
+        corpus_size = generate_corpus(corpus_path, opts)
+        results = {}
+        for values in itertools.product([False, True], repeat=len(SCAN_OPTIONS)):
+            flags = dict(zip(SCAN_OPTIONS, values))
+            name = ','.join([o for o in SCAN_OPTIONS if flags[o]]) or 'regex_only'
+            timings = []
+            for i in range(opts.repeat):
+                start = time.time()
+                secret_records = code_secrets.scan_for_secrets(scan_args(opts, flags), corpus_path, corpus_path)
+                timings.append(time.time() - start)
+            best = min(timings)
+            results[name] = {'seconds': round(best, 4),
+                    'mb_per_s': round(corpus_size / (1024.0 * 1024.0) / best, 3),
+                    'files_per_s': round(opts.files / best, 1),
+                    'secrets': len(secret_records)}
+            print('%-50s %8.3fs %10.3f MB/s %10.1f files/s %7d secrets' % (name, best,
+                results[name]['mb_per_s'], results[name]['files_per_s'], len(secret_records)))
+    finally:
+        shutil.rmtree(corpus_path)
+    return corpus_size, results
+
+
+def corpus_key(opts):
+    return 'files=%d,dirs=%d,lines=%d,line_length=%d,secret_density=%s,binary_ratio=%s,minified_ratio=%s,seed=%d,workers=%d' % (
+        opts.files, opts.dirs, opts.lines, opts.line_length, opts.secret_density, opts.binary_ratio,
+        opts.minified_ratio, opts.seed, opts.workers)
+
+
+def load_results(results_file):
+    if not os.path.isfile(results_file):
+        return {}
+    with open(results_file, 'r') as fd:
+        return json.load(fd)
+
+
+def compare(all_results, key, commit, other_commit):
+    other = all_results.get(other_commit, {}).get(key)
+    current = all_results.get(commit, {}).get(key)
+    if other is None or current is None:
+        print('No results to compare for commit [%s] with the same corpus' % other_commit)
+        return
+    print('\nThroughput relative to %s (>1.0 is faster)' % other_commit)
+    for name in sorted(current['results']):
+        if name in other['results']:
+            ratio = current['results'][name]['mb_per_s'] / other['results'][name]['mb_per_s']
+            print('%-50s %6.2fx' % (name, ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the secrets scan on a synthetic repository')
+    parser.add_argument('--files', type=int, default=1000, help='Number of files to generate')
+    parser.add_argument('--dirs', type=int, default=20, help='Number of top level directories')
+    parser.add_argument('--lines', type=int, default=200, help='Lines per file')
+    parser.add_argument('--line_length', type=int, default=80, help='Approximate length of the lines')
+    parser.add_argument('--secret_density', type=float, default=0.005, help='Fraction of lines holding a secret')
+    parser.add_argument('--binary_ratio', type=float, default=0.05, help='Fraction of binary files')
+    parser.add_argument('--minified_ratio', type=float, default=0.05, help='Fraction of minified (single line) files')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the corpus')
+    parser.add_argument('--workers', type=int, default=1, help='Value of --secrets_workers')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per combination, the best one is recorded')
+    parser.add_argument('--results', default='bench_results.json', help='JSON file the results are added to')
+    parser.add_argument('--compare', help='Git commit from the results file to compare with')
+    opts = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    commit = get_commit()
+    key = corpus_key(opts)
+    print('Commit %s, corpus %s' % (commit, key))
+    corpus_size, results = run_benchmarks(opts)
+
+    all_results = load_results(opts.results)
+    all_results.setdefault(commit, {})[key] = {'corpus_bytes': corpus_size, 'python': sys.version.split()[0],
+            'timestamp': int(time.time()), 'results': results}
+    with open(opts.results, 'w') as fd:
+        json.dump(all_results, fd, indent=2, sort_keys=True)
+    if opts.compare:
+        compare(all_results, key, commit, opts.compare)
+
+
+if __name__ == '__main__':
+    main()
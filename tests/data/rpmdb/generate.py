@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Generates the rpm database fixtures used by tests/test_rpmdb.py.
+
+One small database per format holding the same packages, in the layout rpm writes them:
+a BerkeleyDB hash "Packages" in both byte orders (with headers on overflow pages and one
+stored on the hash page), an NDB "Packages.db" (with an unused slot) and a sqlite
+"rpmdb.sqlite". Run from this directory to regenerate them.
+
+    python generate.py
+"""
+
+import os
+import struct
+import sqlite3
+
+PACKAGES = [('bash', '5.1.8', '6.el9', 'x86_64'), ('openssl-libs', '3.0.1', '41.el9', 'x86_64'),
+        ('tzdata', '2022a', '1.el9', 'noarch'), ('gpg-pubkey', 'fd431d51', '4ae0493b', None),
+        ('big-pkg', '1.0', '1', 'x86_64')]
+BDB_PAGE_SIZE = 512
+
+
+def header_blob(name, version, release, arch):
+    # header region tag, the string tags, a long summary (for big-pkg) and an int32 tag
+    entries = [(63, 7, 0, 16)]
+    data = b'\0' * 16
+    tags = [(1000, name), (1001, version), (1002, release)]
+    if arch is not None:
+        tags.append((1022, arch))
+    if name == 'big-pkg':
+        tags.append((1004, 'x' * 1200))
+    for tag, value in tags:
+        entries.append((tag, 6, len(data), 1))
+        data = data + value.encode('utf-8') + b'\0'
+    entries.append((1009, 4, len(data), 1))
+    data = data + struct.pack('>I', 12345)
+    blob = struct.pack('>II', len(entries), len(data))
+    for entry in entries:
+        blob = blob + struct.pack('>iIiI', *entry)
+    return blob + data
+
+
+def write_sqlite(path, blobs):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE Packages (hnum INTEGER PRIMARY KEY AUTOINCREMENT, blob BLOB NOT NULL)')
+    for blob in blobs:
+        conn.execute('INSERT INTO Packages (blob) VALUES (?)', (blob,))
+    conn.commit()
+    conn.close()
+
+
+def write_ndb(path, blobs):
+    slots = []
+    blob_area = b''
+    first_block = 4096 // 16
+    for index, blob in enumerate(blobs):
+        record = struct.pack('<IIII', 0x53626c42, index + 1, 1, len(blob)) + blob
+        record = record + b'\0' * (-len(record) % 16)
+        slots.append(struct.pack('<IIII', 0x746f6c53, index + 1, first_block + len(blob_area) // 16, len(record) // 16))
+        blob_area = blob_area + record
+    slots.insert(1, struct.pack('<IIII', 0x746f6c53, 0, 0, 0)) # free slot
+    slot_page = struct.pack('<IIII', 0x506d7052, 0, 1, 1) + b'\0' * 16 + b''.join(slots)
+    while len(slot_page) < 4096:
+        slot_page = slot_page + struct.pack('<IIII', 0x746f6c53, 0, 0, 0)
+    with open(path, 'wb') as fd:
+        fd.write(slot_page + blob_area)
+
+
+def write_bdb(path, blobs, byte_order):
+    pages = { }
+    def page_header(pgno, prev_pgno, next_pgno, entries, hf_offset, page_type):
+        return struct.pack(byte_order + 'QIIIHHBB', 0, pgno, prev_pgno, next_pgno, entries, hf_offset, 0, page_type)
+    # key / value items of the hash page, the third header is stored on the page itself
+    items = [(struct.pack(byte_order + 'I', 0), b'\x01' + struct.pack(byte_order + 'I', len(blobs)))]
+    for index, blob in enumerate(blobs):
+        key = struct.pack(byte_order + 'I', index + 1)
+        if index == 2:
+            items.append((key, b'\x01' + blob))
+            continue
+        chunk = BDB_PAGE_SIZE - 26
+        overflow_pages = []
+        for offset in range(0, len(blob), chunk):
+            overflow_pages.append((len(pages) + 2, blob[offset:offset + chunk]))
+            pages[len(pages) + 2] = None
+        for position, (pgno, part) in enumerate(overflow_pages):
+            next_pgno = overflow_pages[position + 1][0] if position + 1 < len(overflow_pages) else 0
+            prev_pgno = overflow_pages[position - 1][0] if position > 0 else 0
+            pages[pgno] = page_header(pgno, prev_pgno, next_pgno, 1, len(part), 7) + part
+        items.append((key, struct.pack(byte_order + 'B3xII', 3, overflow_pages[0][0], len(blob))))
+    offsets = []
+    body = bytearray(BDB_PAGE_SIZE)
+    top = BDB_PAGE_SIZE
+    for key, value in items:
+        for item in (b'\x01' + key, value):
+            top = top - len(item)
+            body[top:top + len(item)] = item
+            offsets.append(top)
+    header = page_header(1, 0, 0, len(offsets), top, 13) + struct.pack(byte_order + str(len(offsets)) + 'H', *offsets)
+    body[:len(header)] = header
+    pages[1] = bytes(body)
+    meta = bytearray(BDB_PAGE_SIZE)
+    struct.pack_into(byte_order + 'QIIIIBBBBII', meta, 0, 0, 0, 0x061561, 9, BDB_PAGE_SIZE, 0, 8, 0, 0, 0, len(pages))
+    with open(path, 'wb') as fd:
+        fd.write(bytes(meta))
+        for pgno in range(1, len(pages) + 1):
+            fd.write(pages[pgno].ljust(BDB_PAGE_SIZE, b'\0'))
+
+
+def main():
+    blobs = [header_blob(*package) for package in PACKAGES]
+    for name in ['sqlite', 'ndb', 'bdb-le', 'bdb-be']:
+        if not os.path.isdir(name):
+            os.makedirs(name)
+    if os.path.isfile('sqlite/rpmdb.sqlite'):
+        os.remove('sqlite/rpmdb.sqlite')
+    write_sqlite('sqlite/rpmdb.sqlite', blobs)
+    write_ndb('ndb/Packages.db', blobs)
+    write_bdb('bdb-le/Packages', blobs, '<')
+    write_bdb('bdb-be/Packages', blobs, '>')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `twigs.repo`."""
+
+
+import io
+import json
+import os
+import shutil
+import argparse
+import tempfile
+import unittest
+import subprocess
+import zipfile
+from unittest import mock
+
+from twigs import repo
+from twigs import utils
+
+
+def write_jar(path, entries):
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, content in entries.items():
+            zf.writestr(name, content)
+
+
+def nested_jar(version):
+    inner = io.BytesIO()
+    write_jar(inner, {'META-INF/maven/org.x/inner/pom.properties': 'artifactId=inner\nversion=%s\n' % version})
+    return inner.getvalue()
+
+
+@unittest.skipUnless(os.path.isfile(repo.GIT_PATH), "git is not available")
+class TestRepoSince(unittest.TestCase):
+    """Tests for the incremental (--since) repo discovery."""
+
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        self.out_file = os.path.join(tempfile.mkdtemp(), 'out.json')
+        self.git('init', '-q')
+        repo.changed_files_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_path)
+        shutil.rmtree(os.path.dirname(self.out_file))
+
+    def git(self, *cmdarr):
+        subprocess.check_output([repo.GIT_PATH, '-c', 'user.name=twigs', '-c', 'user.email=twigs@localhost'] + list(cmdarr),
+                cwd=self.repo_path)
+
+    def get_args(self, since, repo_type='jar'):
+        return argparse.Namespace(repo=self.repo_path, since=since, previous_assets=self.out_file, out=None,
+                type=repo_type, level='shallow', assetid='app', assetname=None, handle='twigs@localhost',
+                inventory_workers=1, cache_dir=None, secrets_scan=False, secrets_history=False, sast=False)
+
+    def test_nested_jar_modified(self):
+        """Products of nested jars in a changed archive are not carried over from the previous run."""
+        jar_path = os.path.join(self.repo_path, 'app.jar')
+        write_jar(jar_path, {'BOOT-INF/lib/inner.jar': nested_jar('1.0')})
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', 'initial')
+        assets = repo.get_inventory(self.get_args(None))
+        self.assertIn('inner 1.0 source:app.jar!/BOOT-INF/lib/inner.jar', assets[0]['products'])
+        with open(self.out_file, 'w') as fd:
+            json.dump(assets, fd)
+
+        write_jar(jar_path, {'BOOT-INF/lib/inner.jar': nested_jar('2.0')})
+        assets = repo.get_inventory(self.get_args('HEAD'))
+        products = assets[0]['products']
+        self.assertIn('inner 2.0 source:app.jar!/BOOT-INF/lib/inner.jar', products)
+        self.assertNotIn('inner 1.0 source:app.jar!/BOOT-INF/lib/inner.jar', products)
+        self.assertEqual(['inner 2.0'], assets[0]['compliance_metadata']['source_metadata']['technology_products']['jar'])
+
+    def test_package_json_changed_with_lock(self):
+        """A changed package.json is not parsed while there is a package-lock.json, as in a full scan."""
+        package_json = {'name': 'app', 'version': '1.0.0', 'dependencies': {'left-pad': '^1.0.0'}}
+        with open(os.path.join(self.repo_path, 'package.json'), 'w') as fd:
+            json.dump(package_json, fd)
+        with open(os.path.join(self.repo_path, 'package-lock.json'), 'w') as fd:
+            json.dump({'name': 'app', 'version': '1.0.0', 'lockfileVersion': 1,
+                    'dependencies': {'left-pad': {'version': '1.3.0'}}}, fd)
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', 'initial')
+        assets = repo.get_inventory(self.get_args(None, 'npm'))
+        with open(self.out_file, 'w') as fd:
+            json.dump(assets, fd)
+
+        package_json['description'] = 'changed'
+        with open(os.path.join(self.repo_path, 'package.json'), 'w') as fd:
+            json.dump(package_json, fd)
+        incremental = repo.get_inventory(self.get_args('HEAD', 'npm'))
+        full = repo.get_inventory(self.get_args(None, 'npm'))
+        self.assertEqual(sorted(full[0]['products']), sorted(incremental[0]['products']))
+        self.assertFalse([p for p in incremental[0]['products'] if p.endswith('source:package.json')])
+
+
+LOCKFILE = {
+    'name': u'caf\u00e9-app', 'version': '1.0.0', 'lockfileVersion': 2,
+    'packages': {
+        '': {'name': u'caf\u00e9-app', 'version': '1.0.0'},
+        'node_modules/left-pad': {'version': '1.3.0', 'dependencies': {'repeat-string': '^1.0.0'}},
+        u'node_modules/\u65e5\u672c': {'version': u'2.0.0-\u03b2'},
+        'node_modules/a/node_modules/b': {'version': '0.1.0'},
+    },
+    'dependencies': {
+        'left-pad': {'version': '1.3.0', 'requires': {'repeat-string': '^1.0.0'}, 'dev': False,
+                'integrity': 'sha512-\\"quoted\\" \\/ \\\\ \\b\\f\\n\\r\\t'},
+        u'\u65e5\u672c': {'version': u'2.0.0-\u03b2', 'resolved': u'https://example.com/\U0001f600.tgz'},
+        'emoji': {'version': u'3.0.0', 'requires': {u'\U0001f600': u'~1.0.\u00e9'}, 'nested': [1, 2.5e3, True, None, {}]},
+        'tab\tname': '^4.1.x',
+        'quote"back\\slash/': u'1.0.0-\u00e9\U0001f600',
+    },
+    'devDependencies': {'mocha': '>=9.0.0'},
+    'optionalDependencies': {u'\u00fcber': '*'},
+}
+
+
+class TestPackageJsonStream(unittest.TestCase):
+    """Tests that streamed package.json files give the same products as parsed ones."""
+
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def check_stream(self, cjson, ensure_ascii):
+        with io.open(self.file_path, 'w', encoding='utf-8') as fd:
+            fd.write(json.dumps(cjson, ensure_ascii=ensure_ascii, indent=1))
+        for level in ('shallow', 'deep'):
+            expected = repo.get_package_json_products(cjson, level, 'package-lock.json')
+            self.assertTrue(len(expected) > 0)
+            # small read sizes put chunk boundaries inside strings, escapes and characters
+            for read_size in range(1, 18):
+                with mock.patch.object(utils, 'JSON_READ_SIZE', read_size):
+                    with io.open(self.file_path, 'r', encoding='utf-8') as fd:
+                        self.assertEqual(expected, repo.stream_package_json_products(fd, level, 'package-lock.json'))
+            with mock.patch.object(repo, 'PACKAGE_JSON_STREAM_SIZE', -1):
+                with io.open(self.file_path, 'r', encoding='utf-8') as fd:
+                    self.assertEqual(expected, repo.parse_package_json_file(fd, level, 'package-lock.json'))
+
+    def test_lockfile(self):
+        self.check_stream(LOCKFILE, False)
+        self.check_stream(LOCKFILE, True)
+
+    def test_packages_only(self):
+        """lockfileVersion 3 files have the packages map only."""
+        cjson = dict(LOCKFILE)
+        del cjson['dependencies']
+        self.check_stream(cjson, False)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `twigs.rpmdb`."""
+
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from twigs import rpmdb
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'rpmdb')
+EXPECTED = [('bash', '5.1.8', '6.el9', 'x86_64'), ('openssl-libs', '3.0.1', '41.el9', 'x86_64'),
+        ('tzdata', '2022a', '1.el9', 'noarch'), ('gpg-pubkey', 'fd431d51', '4ae0493b', '(none)'),
+        ('big-pkg', '1.0', '1', 'x86_64')]
+
+
+class TestRpmdb(unittest.TestCase):
+    """Tests reading the packages of the rpm database fixtures made by tests/data/rpmdb/generate.py."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_sqlite(self):
+        self.assertEqual(EXPECTED, rpmdb.read_packages(os.path.join(DATA_PATH, 'sqlite')))
+
+    def test_ndb(self):
+        self.assertEqual(EXPECTED, rpmdb.read_packages(os.path.join(DATA_PATH, 'ndb')))
+
+    def test_bdb_little_endian(self):
+        self.assertEqual(EXPECTED, rpmdb.read_packages(os.path.join(DATA_PATH, 'bdb-le')))
+
+    def test_bdb_big_endian(self):
+        self.assertEqual(EXPECTED, rpmdb.read_packages(os.path.join(DATA_PATH, 'bdb-be')))
+
+    def test_no_database(self):
+        self.assertIsNone(rpmdb.read_packages(self.path))
+        self.assertIsNone(rpmdb.read_packages(os.path.join(self.path, 'missing')))
+
+    def test_unreadable_database(self):
+        with open(os.path.join(self.path, 'Packages'), 'wb') as fd:
+            fd.write(b'garbage' * 100)
+        self.assertIsNone(rpmdb.read_packages(self.path))
+
+    def test_ndb_slot_pages_past_end(self):
+        """A slot page count larger than the file does not make the reader go past its end."""
+        with open(os.path.join(DATA_PATH, 'ndb', 'Packages.db'), 'rb') as fd:
+            content = bytearray(fd.read())
+        struct.pack_into('<I', content, 12, 0xffffffff)
+        with open(os.path.join(self.path, 'Packages.db'), 'wb') as fd:
+            fd.write(bytes(content))
+        self.assertEqual(EXPECTED, rpmdb.read_packages(self.path))
@@ -4,47 +4,261 @@ import json
 import re
 import math
 import mmap
+import logging
+import multiprocessing
+import collections
+import codecs
+import hashlib
+import binascii
+import subprocess
+import tempfile
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 from . import utils as lib_utils
 from . import code_secrets_defaults as cs_defaults
 
 BASE64_CHARACTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
 HEX_CHARACTERS = "1234567890abcdefABCDEF"
-regex_rules = { }
-common_pwds = [ ]
+BASE64_REGEX = re.compile('[' + re.escape(BASE64_CHARACTERS) + ']{21,}')
+HEX_REGEX = re.compile('[' + re.escape(HEX_CHARACTERS) + ']{21,}')
+ALPHANUMERIC_CHARACTERS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789")
+MIN_LITERAL_LENGTH = 3
+READ_BLOCK_SIZE = 1024 * 1024
+LARGE_FILE_MAX_LINE_LENGTH = 1024 * 1024
+# pieces of long lines overlap by this, longer than any secret the rules match
+LARGE_FILE_LINE_OVERLAP = 512
+SECRETS_CACHE_VERSION = 1
+BOM_ENCODINGS = [(codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]
+REPEAT_OPS = [sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT]
+if hasattr(sre_parse, 'POSSESSIVE_REPEAT'):
+    REPEAT_OPS.append(sre_parse.POSSESSIVE_REPEAT)
+worker_context = { }
+charset_regexes = { }
 textchars = bytearray({7,8,9,10,12,13,27} | set(range(0x20, 0x100)) - {0x7f})
 is_binary_string = lambda in_bytes: bool(in_bytes.translate(None, textchars))
 
 def shannon_entropy(data, iterator):
     if not data:
         return 0
+    # Histogram is built in a single pass, but the sum is still accumulated in
+    # iterator order so results are bit for bit the same as counting per character
+    counts = collections.Counter(data)
     entropy = 0
     for x in iterator:
-        p_x = float(data.count(x))/len(data)
+        p_x = float(counts[x])/len(data)
         if p_x > 0:
             entropy += - p_x*math.log(p_x, 2)
     return entropy
 
+def get_charset_regex(charset, threshold):
+    key = (charset, threshold)
+    regex = charset_regexes.get(key)
+    if regex is None:
+        regex = re.compile('[' + re.escape(charset) + ']{' + str(threshold + 1) + ',}')
+        charset_regexes[key] = regex
+    return regex
+
 def extract_strings(word, charset, threshold=20):
-    count = 0
-    letters = ""
-    strings = []
-    for char in word:
-        if char in charset:
-            letters += char
-            count += 1
-        else:
-            if count > threshold:
-                strings.append(letters)
-            letters = ""
-            count = 0
-    if count > threshold:
-        strings.append(letters)
-    return strings
-
-def hide_secrets(lines):
+    # Runs of more than threshold characters from charset
+    return get_charset_regex(charset, threshold).findall(word)
+
+def score_entropy_candidates(content):
+    # Entropy of every distinct base64 / hex candidate in the content, so that
+    # strings repeated across lines of a file are only scored once
+    scores = { 'base64': { }, 'hex': { } }
+    for string in BASE64_REGEX.findall(content):
+        if string not in scores['base64']:
+            scores['base64'][string] = shannon_entropy(string, BASE64_CHARACTERS)
+    for string in HEX_REGEX.findall(content):
+        if string not in scores['hex']:
+            scores['hex'][string] = shannon_entropy(string, HEX_CHARACTERS)
+    return scores
+
+def build_regex_matcher(rules):
+    # Combine all rules into a single alternation with one named group per rule,
+    # so a line is searched once and the matched group identifies the rule
+    if len(rules) == 0:
+        return None
+    alternatives = []
+    for index, key in enumerate(rules):
+        pattern = rules[key].pattern
+        if rules[key].groups > 0 and re.search(r'\\[1-9]|\(\?P=', pattern):
+            # numbered / named back references would break once rules are combined
+            return None
+        alternatives.append('(?P<twigs_rule_' + str(index) + '>' + pattern + ')')
+    try:
+        return re.compile('|'.join(alternatives))
+    except re.error as e:
+        logging.debug("Unable to combine regex rules, falling back to per rule matching: %s", e)
+        return None
+
+def literal_char(op, av):
+    # Returns the (lower cased) ASCII character matched by a regex node, if it matches exactly one
+    if op == sre_parse.LITERAL:
+        char = chr(av)
+    elif op == sre_parse.IN:
+        chars = set()
+        for item_op, item_av in av:
+            if item_op != sre_parse.LITERAL:
+                return None
+            chars.add(chr(item_av).lower())
+        if len(chars) != 1:
+            return None
+        char = chars.pop()
+    else:
+        return None
+    if ord(char) >= 128:
+        return None
+    return char.lower()
+
+def collect_literal_runs(parsed, runs):
+    current = ''
+    for op, av in parsed:
+        char = literal_char(op, av)
+        if char is not None:
+            current = current + char
+            continue
+        if op == sre_parse.AT:
+            continue # anchors do not consume characters
+        runs.append(current)
+        current = ''
+        if op == sre_parse.SUBPATTERN:
+            # (?i:...) matches case variants beyond what lower casing the content covers, like 'ſ' for 's'
+            if len(av) == 4 and av[1] & re.IGNORECASE:
+                continue
+            collect_literal_runs(av[-1], runs)
+        elif op in REPEAT_OPS and av[0] >= 1:
+            collect_literal_runs(av[2], runs)
+    runs.append(current)
+
+def extract_required_literal(regex):
+    # Longest literal (lower cased) which has to be present in any text matched by the regex
+    if regex.flags & re.IGNORECASE:
+        return None
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return None
+    runs = []
+    collect_literal_runs(parsed, runs)
+    literal = max(runs, key=len)
+    if len(literal) < MIN_LITERAL_LENGTH:
+        return None
+    return literal
+
+def select_file_rules(rules, lowered_content):
+    # Keep only the rules whose required literal is present in the file (or which have none)
+    present = { }
+    keys = []
+    for key in rules['regex_rules']:
+        literal = rules['literals'][key]
+        if literal is not None:
+            if literal not in present:
+                present[literal] = literal in lowered_content
+            if not present[literal]:
+                continue
+        keys.append(key)
+    keys = tuple(keys)
+    file_rules = rules['file_rules_cache'].get(keys)
+    if file_rules is None:
+        file_rules = rules.copy()
+        file_rules['regex_rules'] = dict((key, rules['regex_rules'][key]) for key in keys)
+        file_rules['regex_matcher'] = build_regex_matcher(file_rules['regex_rules'])
+        rules['file_rules_cache'][keys] = file_rules
+    return file_rules
+
+def match_regex_rules(rules, line):
+    # Returns the first rule (in rule order) that matches the line along with the match
+    regex_rules = rules['regex_rules']
+    regex_matcher = rules['regex_matcher']
+    keys = list(regex_rules)
+    if regex_matcher is not None:
+        combined = regex_matcher.search(line)
+        if combined is None:
+            return None, None
+        # combined match is the leftmost one, so only rules ahead of it need to be confirmed
+        matched_index = int(combined.lastgroup[len('twigs_rule_'):])
+        for key in keys[:matched_index]:
+            matched = regex_rules[key].search(line)
+            if matched:
+                return key, matched
+        return keys[matched_index], regex_rules[keys[matched_index]].search(line, combined.start())
+    for key in keys:
+        matched = regex_rules[key].search(line)
+        if matched:
+            return key, matched
+    return None, None
+
+def build_password_automaton(passwords):
+    # Aho-Corasick automaton over all the common passwords. States are indexes into the
+    # goto / fail / out lists, out holds the indexes of the passwords ending in a state
+    goto = [{ }]
+    fail = [0]
+    out = [[]]
+    for index, password in enumerate(passwords):
+        state = 0
+        for char in password:
+            next_state = goto[state].get(char)
+            if next_state is None:
+                next_state = len(goto)
+                goto[state][char] = next_state
+                goto.append({ })
+                fail.append(0)
+                out.append([])
+            state = next_state
+        out[state].append(index)
+    queue = collections.deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, next_state in goto[state].items():
+            queue.append(next_state)
+            fallback = fail[state]
+            while fallback and char not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[next_state] = goto[fallback].get(char, 0)
+            if out[fail[next_state]]:
+                out[next_state] = out[next_state] + out[fail[next_state]]
+    automaton = { }
+    automaton['goto'] = goto
+    automaton['fail'] = fail
+    automaton['out'] = out
+    automaton['passwords'] = passwords
+    return automaton
+
+def is_password_boundary(line, index):
+    # A password must be surrounded by non alphanumeric characters, like "password" or (password)
+    return 0 <= index < len(line) and line[index] not in ALPHANUMERIC_CHARACTERS
+
+def find_common_passwords(automaton, line):
+    # Returns the indexes of all the common passwords found in the line with valid boundaries
+    goto = automaton['goto']
+    fail = automaton['fail']
+    out = automaton['out']
+    passwords = automaton['passwords']
+    matched = set()
+    state = 0
+    for position, char in enumerate(line):
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        if out[state]:
+            for index in out[state]:
+                if index in matched:
+                    continue
+                if is_password_boundary(line, position - len(passwords[index])) and is_password_boundary(line, position + 1):
+                    matched.add(index)
+    return matched
+
+def hide_secrets(lines, rules):
+    regex_rules = rules['regex_rules']
+    regex_matcher = rules['regex_matcher']
     ret_lines = []
     for line_content in lines.split('\n'):
-        for word in line_content.split():
+        # hex characters are a subset of base64 characters, so no base64 candidate means no hex one either
+        words = line_content.split() if BASE64_REGEX.search(line_content) else []
+        for word in words:
             b64_strings = extract_strings(word, BASE64_CHARACTERS)
             hex_strings = extract_strings(word, HEX_CHARACTERS)
             for string in b64_strings:
@@ -55,139 +269,247 @@ def hide_secrets(lines):
                 hex_entropy = shannon_entropy(string, HEX_CHARACTERS)
                 if hex_entropy > 3:
                     line_content = line_content.replace(string, "*" * len(string))
-        for key in regex_rules:
-            matched = regex_rules[key].search(line_content)
-            if matched:
-                string = matched.group()
-                line_content = line_content.replace(string, "*" * len(string))
-        for cp in common_pwds:
-            matched = cp.search(line_content)
-            if matched:
-                string = matched.group()[1:-1] # remove the qoutes
+        if regex_matcher is None or regex_matcher.search(line_content):
+            for key in regex_rules:
+                matched = regex_rules[key].search(line_content)
+                if matched:
+                    string = matched.group()
+                    line_content = line_content.replace(string, "*" * len(string))
+        automaton = rules['password_automaton']
+        if automaton is not None:
+            # Mask passwords in list order, re-checking the line after each replacement
+            # since masking can remove or introduce boundaries for later passwords
+            last_index = -1
+            while True:
+                matched = [index for index in find_common_passwords(automaton, line_content) if index > last_index]
+                if len(matched) == 0:
+                    break
+                last_index = min(matched)
+                string = automaton['passwords'][last_index]
                 line_content = line_content.replace(string, "*" * len(string))
         ret_lines.append(line_content)
     return "\n".join(ret_lines)
 
-def truncate_code_snippet(secret_record):
+def truncate_line(line):
     max_line_length = 1000 # Column data type allows 65535 characters and there are 5 lines
     truncated_indicator = '...truncated...'
-    if len(secret_record['line_content']) > max_line_length:
-        truncated = secret_record['line_content'][:max_line_length]
-        secret_record['line_content'] = truncated + truncated_indicator
-    truncated = ''
-    for line in secret_record['before_content'].split('\n'):
-        if len(truncated) > 0:
-            truncated = truncated + '\n'
-        if len(line) > max_line_length:
-            truncated = truncated + line[:max_line_length] + truncated_indicator
-        else:
-            truncated = truncated + line
-    secret_record['before_content'] = truncated
-    truncated = ''
-    for line in secret_record['after_content'].split('\n'):
-        if len(truncated) > 0:
-            truncated = truncated + '\n'
-        if len(line) > max_line_length:
-            truncated = truncated + line[:max_line_length] + truncated_indicator
-        else:
-            truncated = truncated + line
-    secret_record['after_content'] = truncated
-
-def create_secret_record(filename, lines, line_no, record_type, line_content, secret, args):
-    to_mask = args.mask_secret
-    secret_record = { }
-    secret_record['filename'] = filename
-    secret_record['line_no'] = line_no + 1
-    secret_record['discovered_using'] = record_type.split(':')[0]
-    if secret_record['discovered_using'] == 'REGEX':
-        secret_record['regex'] = record_type[len(secret_record['discovered_using'])+1:]
-    if line_no >= 2:
-        before_content = lib_utils.ascii_string(lines[line_no-2]) + '\n' + lib_utils.ascii_string(lines[line_no-1])
-    elif line_no == 1:
-        before_content = lib_utils.ascii_string(lines[line_no-1])
-    else:
-        before_content = ''
-    if line_no < len(lines) - 2:
-        after_content = lib_utils.ascii_string(lines[line_no+1]) + '\n' + lib_utils.ascii_string(lines[line_no+2])
-    elif line_no == len(lines) - 2:
-        after_content = lib_utils.ascii_string(lines[line_no+1])
-    else:
-        after_content = ''
-    if args.no_code:
-        secret_record['line_content'] = ''
-        secret_record['before_content'] = ''
-        secret_record['after_content'] = ''
-    else:
-        secret_length = len(secret)
-        line_content = lib_utils.ascii_string(line_content)
-        secret_record['column_start'] = line_content.find(secret)
-        if secret_record['column_start'] != -1:
-            secret_record['column_end'] = secret_record['column_start'] + secret_length - 1
+    if len(line) > max_line_length:
+        return line[:max_line_length] + truncated_indicator
+    return line
+
+class SecretFinding(object):
+    # Compact record of a finding. The raw line and context are kept as found and turned into
+    # the (masked and truncated) secret record by materialize_secret_records at the end of the block
+    __slots__ = ('filename', 'line_no', 'record_type', 'line', 'secret', 'before_lines', 'after_lines')
+
+    def __init__(self, filename, line_no, record_type, line, secret, before_lines, after_lines):
+        self.filename = filename
+        self.line_no = line_no
+        self.record_type = record_type
+        self.line = line
+        self.secret = secret
+        self.before_lines = before_lines
+        self.after_lines = after_lines
+
+def create_secret_record(filename, context, line_no, record_type, line_content, secret):
+    before_lines, after_lines = context
+    return SecretFinding(filename, line_no, record_type, line_content, secret, before_lines, after_lines)
+
+def materialize_secret_records(findings, args, rules):
+    # Context lines are shared by neighbouring findings, so each one is converted and masked once
+    context_lines = { }
+    def get_context(lines):
+        context = ''
+        for line in lines:
+            if line not in context_lines:
+                context_line = lib_utils.ascii_string(line)
+                if args.mask_secret:
+                    context_line = hide_secrets(context_line, rules)
+                context_lines[line] = truncate_line(context_line)
+            if len(context) > 0: # leading empty lines are dropped
+                context = context + '\n'
+            context = context + context_lines[line]
+        return context
+
+    secret_records = []
+    for finding in findings:
+        secret_record = { }
+        secret_record['filename'] = finding.filename
+        secret_record['line_no'] = finding.line_no + 1
+        secret_record['discovered_using'] = finding.record_type.split(':')[0]
+        if secret_record['discovered_using'] == 'REGEX':
+            secret_record['regex'] = finding.record_type[len(secret_record['discovered_using'])+1:]
+        if args.no_code:
+            secret_record['line_content'] = ''
+            secret_record['before_content'] = ''
+            secret_record['after_content'] = ''
         else:
-            secret_record['column_end'] = -1
-        if to_mask:
-            line_content = line_content.replace(secret, "*" * secret_length)
-        secret_record['line_content'] = line_content
-        secret_record['before_content'] = hide_secrets(before_content) if to_mask else before_content
-        secret_record['after_content'] = hide_secrets(after_content) if to_mask else after_content
-        truncate_code_snippet(secret_record)
-    return secret_record
-
-def check_entropy(this_file, lines, line, line_no, secret_records, args):
+            secret = finding.secret
+            line_content = lib_utils.ascii_string(finding.line)
+            secret_record['column_start'] = line_content.find(secret)
+            if secret_record['column_start'] != -1:
+                secret_record['column_end'] = secret_record['column_start'] + len(secret) - 1
+            else:
+                secret_record['column_end'] = -1
+            if args.mask_secret:
+                line_content = line_content.replace(secret, "*" * len(secret))
+            secret_record['line_content'] = truncate_line(line_content)
+            secret_record['before_content'] = get_context(finding.before_lines)
+            secret_record['after_content'] = get_context(finding.after_lines)
+        secret_records.append(secret_record)
+    return secret_records
+
+def check_entropy(this_file, context, line, line_no, secret_records, args, rules, scores=None):
+    if BASE64_REGEX.search(line) is None:
+        return
+    if scores is None:
+        scores = score_entropy_candidates(line)
     for word in line.split():
         b64_strings = extract_strings(word, BASE64_CHARACTERS)
         hex_strings = extract_strings(word, HEX_CHARACTERS)
         for string in b64_strings:
-            base64_entropy = shannon_entropy(string, BASE64_CHARACTERS)
+            base64_entropy = scores['base64'][string]
             if base64_entropy > 4.5:
                 secret = string
-                secret_records.append(create_secret_record(this_file, lines, line_no, "ENTROPY_BASE64", line, secret, args))
+                secret_records.append(create_secret_record(this_file, context, line_no, "ENTROPY_BASE64", line, secret))
                 break
         for string in hex_strings:
-            hex_entropy = shannon_entropy(string, HEX_CHARACTERS)
+            hex_entropy = scores['hex'][string]
             if hex_entropy > 3:
                 secret = string
-                secret_records.append(create_secret_record(this_file, lines, line_no, "ENTROPY_HEX", line, secret, args))
+                secret_records.append(create_secret_record(this_file, context, line_no, "ENTROPY_HEX", line, secret))
                 break
     return
 
-def check_common_passwords(this_file, lines, line, line_no, secret_records, args):
-    for cp in common_pwds:
-        matched = cp.search(line)
-        if matched:
-            secret = matched.group()[1:-1] # remove the qoutes
-            secret_records.append(create_secret_record(this_file, lines, line_no, "COMMON_PASSWORD", line, secret, args))
-            break
+def check_common_passwords(this_file, context, line, line_no, secret_records, args, rules):
+    automaton = rules['password_automaton']
+    if automaton is None:
+        return
+    matched = find_common_passwords(automaton, line)
+    if len(matched) > 0:
+        secret = automaton['passwords'][min(matched)]
+        secret_records.append(create_secret_record(this_file, context, line_no, "COMMON_PASSWORD", line, secret))
 
-def check_regex_rules(this_file, lines, line, line_no, secret_records, args):
-    for key in regex_rules:
-        matched = regex_rules[key].search(line)
-        if matched:
-            secret = matched.group()
-            secret_records.append(create_secret_record(this_file, lines, line_no, "REGEX:"+key, line, secret, args))
-            break
+def check_regex_rules(this_file, context, line, line_no, secret_records, args, rules, block_rules=None):
+    # block_rules is the prefiltered subset of rules used for matching, while the
+    # complete rules are used for masking context lines which may come from another block
+    key, matched = match_regex_rules(block_rules if block_rules is not None else rules, line)
+    if matched:
+        secret = matched.group()
+        secret_records.append(create_secret_record(this_file, context, line_no, "REGEX:"+key, line, secret))
 
-def scan_file_for_secrets(args, base_path, this_file, regex_rules):
-    secret_records = []
-    with open(this_file, 'r') as fd:
-        if sys.platform == 'win32':
-            mm_file = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
-        else:
-            mm_file = mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ)
-        lines = mm_file.read(-1)
-        lines = lines.decode(args.encoding)
-        lines = lines.split('\n')
-        line_no = 0
-        stripped_file_path = this_file[len(base_path)+1:]
-        for line in lines:
-            if args.enable_entropy:
-                check_entropy(stripped_file_path, lines, line, line_no, secret_records, args)
-            check_regex_rules(stripped_file_path, lines, line, line_no, secret_records, args)
-            if args.check_common_passwords:
-                check_common_passwords(stripped_file_path, lines, line, line_no, secret_records, args)
+def iter_line_blocks(mm_file, encoding, max_line_length=0):
+    # Yields the lines of the mapped file in blocks of roughly READ_BLOCK_SIZE bytes, with the
+    # same line splitting as split('\n') on the whole decoded content. Only the current block
+    # and the line being assembled are held in memory. When max_line_length is set, longer
+    # lines are returned in pieces of that length, all carrying the same line number. Each
+    # piece repeats the last LARGE_FILE_LINE_OVERLAP characters of the one before it, so a
+    # secret split by the piece boundary is whole in the next piece.
+    decoder = codecs.getincrementaldecoder(encoding)()
+    size = len(mm_file)
+    offset = 0
+    line_no = 0
+    partial = []
+    partial_length = 0
+    while offset < size:
+        chunk = mm_file[offset:offset + READ_BLOCK_SIZE]
+        offset = offset + len(chunk)
+        parts = decoder.decode(chunk, offset >= size).split('\n')
+        block = []
+        for part in parts[:-1]:
+            partial.append(part)
+            block.append((line_no, ''.join(partial)))
             line_no = line_no + 1
+            partial = []
+            partial_length = 0
+        partial.append(parts[-1])
+        partial_length = partial_length + len(parts[-1])
+        if max_line_length > 0 and partial_length > max_line_length:
+            pending = ''.join(partial)
+            while len(pending) > max_line_length:
+                block.append((line_no, pending[:max_line_length]))
+                pending = pending[max_line_length - LARGE_FILE_LINE_OVERLAP:]
+            partial = [pending]
+            partial_length = len(pending)
+        if len(block) > 0:
+            yield block
+    yield [(line_no, ''.join(partial))]
+
+def scan_line(stripped_file_path, context, item, secret_records, args, rules):
+    line_no, line, block_rules, scores = item
+    if args.enable_entropy:
+        check_entropy(stripped_file_path, context, line, line_no, secret_records, args, rules, scores)
+    check_regex_rules(stripped_file_path, context, line, line_no, secret_records, args, rules, block_rules)
+    if args.check_common_passwords:
+        check_common_passwords(stripped_file_path, context, line, line_no, secret_records, args, rules)
+
+def drop_duplicate_findings(findings, line_findings):
+    # A secret in the overlap of two pieces of a long line is found in both. line_findings
+    # holds the line number and the findings of the last line, across blocks.
+    unique = []
+    for finding in findings:
+        if finding.line_no != line_findings[0]:
+            line_findings[0] = finding.line_no
+            line_findings[1] = set()
+        key = (finding.record_type, finding.secret)
+        if key not in line_findings[1]:
+            line_findings[1].add(key)
+            unique.append(finding)
+    return unique
+
+def scan_buffer_for_secrets(args, stripped_file_path, buf, rules, max_line_length=0, encoding=None):
+    if encoding is None:
+        encoding = args.encoding
+    secret_records = []
+    findings = []
+    # Lines are scanned once the two lines after them (needed as context) have been read. The
+    # findings are turned into records after each block, so no raw lines are kept beyond it.
+    before = collections.deque(maxlen=2)
+    pending = collections.deque()
+    line_findings = [None, set()]
+    for block in iter_line_blocks(buf, encoding, max_line_length):
+        block_content = '\n'.join([line for line_no, line in block])
+        block_rules = select_file_rules(rules, block_content.lower())
+        scores = score_entropy_candidates(block_content) if args.enable_entropy else None
+        for line_no, line in block:
+            pending.append((line_no, line, block_rules, scores))
+            if len(pending) == 3:
+                context = (list(before), [pending[1][1], pending[2][1]])
+                scan_line(stripped_file_path, context, pending[0], findings, args, rules)
+                before.append(pending.popleft()[1])
+        if len(findings) > 0:
+            if max_line_length > 0:
+                findings = drop_duplicate_findings(findings, line_findings)
+            secret_records.extend(materialize_secret_records(findings, args, rules))
+            findings = []
+    while len(pending) > 0:
+        context = (list(before), [item[1] for item in list(pending)[1:]])
+        scan_line(stripped_file_path, context, pending[0], findings, args, rules)
+        before.append(pending.popleft()[1])
+    if max_line_length > 0:
+        findings = drop_duplicate_findings(findings, line_findings)
+    secret_records.extend(materialize_secret_records(findings, args, rules))
     return secret_records
 
+def map_file(fd):
+    if sys.platform == 'win32':
+        return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    return mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ)
+
+def classify_file(fd, default_encoding):
+    # Returns whether the open file is binary and the encoding to decode it with, from its
+    # first bytes. UTF-16/32 text is recognized by its BOM, which binary detection would reject,
+    # if the first bytes decode to text.
+    head = fd.read(1024)
+    for bom, encoding in BOM_ENCODINGS:
+        if head.startswith(bom):
+            try:
+                text = codecs.getincrementaldecoder(encoding)().decode(head)
+            except UnicodeDecodeError:
+                return True, encoding
+            return is_binary_string(text.encode('utf-8')), encoding
+    return is_binary_string(head), default_encoding
+
 def read_patterns(patterns, patterns_file, msg):
     temp_patterns = []
     if patterns:
@@ -213,35 +535,101 @@ def meets_pattern(this_file, patterns):
             return True
     return False
 
-def scan_for_secrets(args, local_path, base_path):
-    local_path = os.path.abspath(local_path)
-    all_files = lib_utils.find_files(local_path, '')
+def iter_regex_nodes(parsed):
+    # Yields all the (op, av) nodes of a parsed regex, including the nested ones
+    for op, av in parsed:
+        yield op, av
+        for item in (av if isinstance(av, (tuple, list)) else [av]):
+            if isinstance(item, sre_parse.SubPattern):
+                for node in iter_regex_nodes(item):
+                    yield node
+            elif isinstance(item, (tuple, list)):
+                for sub_item in item:
+                    if isinstance(sub_item, sre_parse.SubPattern):
+                        for node in iter_regex_nodes(sub_item):
+                            yield node
 
-    include_patterns = read_patterns(args.include_patterns, args.include_patterns_file, "Both include_patterns and include_patterns_file options are specified. Only include_patterns_file will be considered")
+def parse_pattern(pattern):
+    try:
+        return list(iter_regex_nodes(sre_parse.parse(pattern.pattern, pattern.flags)))
+    except Exception:
+        return None
 
-    exclude_patterns = []
-    # Load default_exclude_patterns
-    for dp in cs_defaults.default_exclude_patterns:
-        exclude_patterns.append(re.compile(dp))
-    user_exclude_patterns = read_patterns(args.exclude_patterns, args.exclude_patterns_file, "Both exclude_patterns and exclude_patterns_file options are specified. Only exclude_patterns_file will be considered")
-    exclude_patterns.extend(user_exclude_patterns)
+def is_prefix_pattern(pattern):
+    # True if a match of the pattern in a path is also a match in any path starting with it,
+    # i.e. the pattern never looks past the end of what it matched
+    nodes = parse_pattern(pattern)
+    if nodes is None:
+        return False
+    for op, av in nodes:
+        if op == sre_parse.AT and av not in [sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING]:
+            return False
+        if op in [sre_parse.ASSERT, sre_parse.ASSERT_NOT] and av[0] >= 0:
+            return False # lookahead
+    return True
+
+def combine_patterns(patterns):
+    # Combines the patterns into a single regex where the patterns allow it, so a path is
+    # searched once instead of once per pattern. Returns a list usable with meets_pattern.
+    default_flags = re.compile('').flags
+    combinable = []
+    others = []
+    for pattern in patterns:
+        nodes = parse_pattern(pattern)
+        if nodes is None or pattern.flags != default_flags or pattern.groups > 0:
+            others.append(pattern)
+        else:
+            combinable.append(pattern)
+    if len(combinable) < 2:
+        return patterns
+    try:
+        combined = re.compile('|'.join(['(?:' + p.pattern + ')' for p in combinable]))
+    except re.error:
+        return patterns
+    return [combined] + others
 
-    final_files = []
-    for this_file in all_files:
-        if len(exclude_patterns) == 0 or (len(exclude_patterns) > 0 and meets_pattern(this_file, exclude_patterns) == False):
-            if len(include_patterns) == 0 or (len(include_patterns) > 0 and meets_pattern(this_file, include_patterns) == True):
-                final_files.append(this_file)
+def walk_scan_files(local_path, include_patterns, exclude_patterns):
+    # Walks local_path returning (path, size) of the non-empty regular files to scan, in os.walk
+    # order. Directories matching an exclude pattern which is also bound to match anything below
+    # them are not descended into. Sizes come from the directory entries, so symlinks and empty
+    # files are dropped without extra system calls.
+    prune_patterns = combine_patterns([p for p in exclude_patterns if is_prefix_pattern(p)])
+    include_patterns = combine_patterns(include_patterns)
+    exclude_patterns = combine_patterns(exclude_patterns)
+    ret_files = []
+    pending_dirs = [local_path]
+    while len(pending_dirs) > 0:
+        root = pending_dirs.pop()
+        subdirs = []
+        try:
+            entries = list(os.scandir(root))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    # like os.walk, symlinks to directories are listed but not followed
+                    if entry.is_symlink() == False and (len(prune_patterns) == 0 or meets_pattern(entry.path + os.sep, prune_patterns) == False):
+                        subdirs.append(entry.path)
+                    continue
+                if entry.is_file(follow_symlinks=False) == False:
+                    continue
+                size = entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+            if size > 0 and is_scan_candidate(entry.path, include_patterns, exclude_patterns):
+                ret_files.append((entry.path, size))
+        pending_dirs.extend(reversed(subdirs))
+    return ret_files
 
-    global regex_rules
+def read_secrets_rules(args):
     if args.regex_rules_file:
         with open(args.regex_rules_file, 'r') as fd:
-            regex_rules = json.load(fd)
+            raw_regex_rules = json.load(fd)
     else:
-        regex_rules = cs_defaults.default_regex_rules
-    for key in regex_rules:
-        regex_rules[key] = re.compile(regex_rules[key]) # store the precompiled regex
+        raw_regex_rules = cs_defaults.default_regex_rules
 
-    global common_pwds
+    common_passwords_list = []
     if args.check_common_passwords:
         if args.common_passwords_file:
             if os.path.isfile(args.common_passwords_file) == False:
@@ -252,15 +640,291 @@ def scan_for_secrets(args, local_path, base_path):
             common_passwords_list = buf.split('\n')
         else:
             common_passwords_list = cs_defaults.common_passwords
-        for cp in common_passwords_list:
-            cp = cp.strip()
-            if len(cp) > 0: # Safety check
-                common_pwds.append(re.compile("[^a-zA-Z0-9]"+cp+"[^a-zA-Z0-9]"))
+    return raw_regex_rules, common_passwords_list
 
-    secret_records = []
-    for this_file in final_files:
-        if os.path.islink(this_file) == False and os.stat(this_file).st_size > 0 and is_binary_string(open(this_file, 'rb').read(1024)) == False:
-            secret_records.extend(scan_file_for_secrets(args, base_path, this_file, regex_rules))
+def compile_secrets_rules(raw_regex_rules, common_passwords_list):
+    rules = { }
+    regex_rules = { }
+    for key in raw_regex_rules:
+        regex_rules[key] = re.compile(raw_regex_rules[key]) # store the precompiled regex
+    rules['regex_rules'] = regex_rules
+    rules['regex_matcher'] = build_regex_matcher(regex_rules)
+    literals = { }
+    for key in regex_rules:
+        literals[key] = extract_required_literal(regex_rules[key])
+    rules['literals'] = literals
+    rules['file_rules_cache'] = { }
+    common_pwds = []
+    for cp in common_passwords_list:
+        cp = cp.strip()
+        if len(cp) > 0: # Safety check
+            common_pwds.append(cp)
+    rules['password_automaton'] = build_password_automaton(common_pwds) if len(common_pwds) > 0 else None
+    return rules
 
+def get_secrets_cache(args, raw_regex_rules, common_passwords_list):
+    if args.cache_dir is None:
+        return None
+    cache = { }
+    cache['path'] = os.path.join(args.cache_dir, 'secrets')
+    if not os.path.isdir(cache['path']):
+        os.makedirs(cache['path'])
+    # Cached records are only valid for the same rules and the options which affect the records
+    fingerprint = [SECRETS_CACHE_VERSION, raw_regex_rules, list(common_passwords_list), args.enable_entropy,
+            args.check_common_passwords, args.mask_secret, args.no_code, args.encoding,
+            args.secrets_max_file_size, args.secrets_large_files]
+    cache['fingerprint'] = hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()
+    return cache
+
+def get_secrets_cache_file(cache, content):
+    key = hashlib.sha256((cache['fingerprint'] + hashlib.sha256(content).hexdigest()).encode('utf-8')).hexdigest()
+    return os.path.join(cache['path'], key[:2], key + '.json')
+
+def read_secrets_cache(cache_file, stripped_file_path):
+    try:
+        with open(cache_file, 'r') as fd:
+            secret_records = json.load(fd)
+        os.utime(cache_file, None) # mark as recently used
+    except (IOError, OSError, ValueError):
+        return None
+    for secret_record in secret_records:
+        secret_record['filename'] = stripped_file_path
     return secret_records
 
+def write_secrets_cache(cache_file, secret_records):
+    cached_records = []
+    for secret_record in secret_records:
+        cached_record = secret_record.copy()
+        del cached_record['filename'] # filename is not part of the content
+        cached_records.append(cached_record)
+    try:
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        temp_file = cache_file + '.' + str(os.getpid())
+        with open(temp_file, 'w') as fd:
+            json.dump(cached_records, fd)
+        os.replace(temp_file, cache_file)
+    except (IOError, OSError) as e:
+        logging.debug("Unable to write secrets cache file [%s]: %s", cache_file, e)
+
+def scan_candidate_file(args, base_path, candidate, rules, cache=None):
+    # The file is opened once, to classify it and then map it for the scan
+    this_file, size = candidate
+    try:
+        fd = open(this_file, 'rb')
+    except (IOError, OSError):
+        logging.error("Unable to read file [%s]", this_file)
+        return []
+    with fd:
+        is_binary, encoding = classify_file(fd, args.encoding)
+        if is_binary:
+            return []
+        try:
+            mm_file = map_file(fd)
+        except ValueError: # file was truncated since the walk
+            return []
+        try:
+            if cache is not None:
+                cache_file = get_secrets_cache_file(cache, mm_file)
+                secret_records = read_secrets_cache(cache_file, this_file[len(base_path)+1:])
+                if secret_records is None:
+                    secret_records = scan_file_for_secrets_with_limits(args, base_path, this_file, len(mm_file), mm_file, encoding, rules)
+                    write_secrets_cache(cache_file, secret_records)
+                return secret_records
+            return scan_file_for_secrets_with_limits(args, base_path, this_file, len(mm_file), mm_file, encoding, rules)
+        except UnicodeDecodeError as e:
+            logging.warning("Unable to decode file [%s] as %s: %s", this_file, encoding, e)
+            return []
+        finally:
+            mm_file.close()
+
+def scan_file_for_secrets_with_limits(args, base_path, this_file, size, mm_file, encoding, rules):
+    stripped_file_path = this_file[len(base_path)+1:]
+    max_file_size = args.secrets_max_file_size * 1024 * 1024
+    if max_file_size > 0 and size > max_file_size:
+        if args.secrets_large_files == 'skip':
+            logging.info("Skipping secrets scan for large file [%s]", this_file)
+            return []
+        # scan the large file in bounded memory by splitting very long lines into chunks
+        return scan_buffer_for_secrets(args, stripped_file_path, mm_file, rules, LARGE_FILE_MAX_LINE_LENGTH, encoding)
+    return scan_buffer_for_secrets(args, stripped_file_path, mm_file, rules, 0, encoding)
+
+def init_secrets_worker(args, base_path, raw_regex_rules, common_passwords_list, cache):
+    # Rules are compiled once per worker process and reused for all files handed to it
+    worker_context['args'] = args
+    worker_context['base_path'] = base_path
+    worker_context['rules'] = compile_secrets_rules(raw_regex_rules, common_passwords_list)
+    worker_context['cache'] = cache
+
+def scan_file_in_worker(candidate):
+    return scan_candidate_file(worker_context['args'], worker_context['base_path'], candidate, worker_context['rules'], worker_context['cache'])
+
+def iter_git_log_blobs(log_output):
+    # Parses the output of git log --raw -z and yields (commit, blob sha, path) for every
+    # regular file added or modified by a commit. The output is read in blocks.
+    commit = None
+    meta = None
+    remainder = b''
+    while True:
+        data = log_output.read(READ_BLOCK_SIZE)
+        if not data:
+            break
+        tokens = (remainder + data).split(b'\0')
+        remainder = tokens.pop()
+        for token in tokens:
+            token = token.strip(b'\n')
+            if meta is not None:
+                # token is the path of the change described by meta
+                old_mode, new_mode, old_sha, new_sha, status = meta.split()
+                meta = None
+                if status != b'D' and new_mode in [b'100644', b'100755']:
+                    yield commit, new_sha.decode('ascii'), token.decode('utf-8', 'replace')
+            elif token.startswith(b'commit '):
+                commit = token[len('commit '):].decode('ascii')
+            elif token.startswith(b':'):
+                meta = token[1:]
+
+def read_git_blob(cat_file, sha, max_size):
+    # Returns the content of the blob read via git cat-file --batch as bytes (or a mapped
+    # temporary file for blobs bigger than READ_BLOCK_SIZE), None if it is missing or larger
+    # than max_size (when max_size > 0)
+    cat_file.stdin.write(sha.encode('ascii') + b'\n')
+    cat_file.stdin.flush()
+    header = cat_file.stdout.readline().split()
+    if len(header) != 3:
+        return None
+    size = int(header[2])
+    if max_size > 0 and size > max_size:
+        # discard the content
+        while size > 0:
+            size = size - len(cat_file.stdout.read(min(size, READ_BLOCK_SIZE)))
+        cat_file.stdout.read(1)
+        return None
+    if size <= READ_BLOCK_SIZE:
+        content = cat_file.stdout.read(size)
+        cat_file.stdout.read(1)
+        return content
+    with tempfile.TemporaryFile() as fd:
+        remaining = size
+        while remaining > 0:
+            chunk = cat_file.stdout.read(min(remaining, READ_BLOCK_SIZE))
+            fd.write(chunk)
+            remaining = remaining - len(chunk)
+        cat_file.stdout.read(1)
+        fd.flush()
+        return map_file(fd)
+
+def get_head_blobs(local_path):
+    # Blobs in the checked out tree are covered by the regular scan
+    head_blobs = set()
+    try:
+        out = subprocess.check_output([lib_utils.GIT_PATH, 'ls-tree', '-r', '-z', 'HEAD'], cwd=local_path, stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, OSError):
+        return head_blobs
+    for entry in out.split(b'\0'):
+        tokens = entry.split(None, 3)
+        if len(tokens) == 4 and tokens[1] == b'blob':
+            head_blobs.add(binascii.unhexlify(tokens[2]))
+    return head_blobs
+
+def scan_history_for_secrets(args, local_path, base_path, rules, include_patterns, exclude_patterns):
+    # Scans the content of files in all the commits of the repo, without checking them out.
+    # Each blob is scanned once, for the most recent commit (and path) which added it. Only
+    # the binary SHAs of the blobs seen so far are held in memory. Merge commits are diffed
+    # against each parent, so content written when resolving a merge is scanned too.
+    if subprocess.call([lib_utils.GIT_PATH, 'rev-parse', '--git-dir'], cwd=local_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) != 0:
+        logging.error("Unable to scan history for secrets. [%s] is not a git repository", local_path)
+        return []
+    seen_blobs = get_head_blobs(local_path)
+    # large blobs get the same treatment as large files in the working tree, only read if chunked
+    max_file_size = args.secrets_max_file_size * 1024 * 1024
+    if args.secrets_large_files == 'chunk':
+        max_file_size = 0
+    secret_records = []
+    blobs_scanned = 0
+    log_cmd = [lib_utils.GIT_PATH, 'log', '--all', '-m', '--raw', '--no-abbrev', '--no-renames', '--root', '--relative', '-z', '--format=commit %H']
+    git_log = subprocess.Popen(log_cmd, cwd=local_path, stdout=subprocess.PIPE)
+    cat_file = subprocess.Popen([lib_utils.GIT_PATH, 'cat-file', '--batch'], cwd=local_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        for commit, sha, path in iter_git_log_blobs(git_log.stdout):
+            blob_id = binascii.unhexlify(sha)
+            if blob_id in seen_blobs:
+                continue
+            seen_blobs.add(blob_id)
+            this_file = os.path.join(local_path, path)
+            if not is_scan_candidate(this_file, include_patterns, exclude_patterns):
+                continue
+            content = read_git_blob(cat_file, sha, max_file_size)
+            if content is None or len(content) == 0 or is_binary_string(content[:1024]):
+                continue
+            blobs_scanned = blobs_scanned + 1
+            try:
+                blob_records = scan_file_for_secrets_with_limits(args, base_path, this_file, len(content), content, args.encoding, rules)
+            finally:
+                if isinstance(content, mmap.mmap):
+                    content.close()
+            for secret_record in blob_records:
+                secret_record['commit'] = commit
+            secret_records.extend(blob_records)
+    finally:
+        cat_file.stdin.close()
+        cat_file.wait()
+        git_log.stdout.close()
+        git_log.wait()
+    logging.info("Scanned %d blobs from the git history for secrets", blobs_scanned)
+    return secret_records
+
+def is_scan_candidate(this_file, include_patterns, exclude_patterns):
+    if len(exclude_patterns) > 0 and meets_pattern(this_file, exclude_patterns):
+        return False
+    if len(include_patterns) > 0 and meets_pattern(this_file, include_patterns) == False:
+        return False
+    return True
+
+def scan_for_secrets(args, local_path, base_path, only_files=None):
+    local_path = os.path.abspath(local_path)
+
+    include_patterns = read_patterns(args.include_patterns, args.include_patterns_file, "Both include_patterns and include_patterns_file options are specified. Only include_patterns_file will be considered")
+
+    exclude_patterns = []
+    # Load default_exclude_patterns
+    for dp in cs_defaults.default_exclude_patterns:
+        exclude_patterns.append(re.compile(dp))
+    user_exclude_patterns = read_patterns(args.exclude_patterns, args.exclude_patterns_file, "Both exclude_patterns and exclude_patterns_file options are specified. Only exclude_patterns_file will be considered")
+    exclude_patterns.extend(user_exclude_patterns)
+
+    final_files = walk_scan_files(local_path, include_patterns, exclude_patterns)
+    if only_files is not None:
+        final_files = [f for f in final_files if f[0] in only_files]
+
+    raw_regex_rules, common_passwords_list = read_secrets_rules(args)
+    cache = get_secrets_cache(args, raw_regex_rules, common_passwords_list)
+
+    workers = args.secrets_workers
+    if workers == 0:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(final_files))
+    secret_records = []
+    if workers > 1:
+        logging.info("Scanning %d files for secrets using %d worker processes", len(final_files), workers)
+        pool = multiprocessing.Pool(workers, init_secrets_worker, (args, base_path, raw_regex_rules, common_passwords_list, cache))
+        try:
+            # imap returns results in the order of final_files, so the output does not depend on scheduling
+            for file_records in pool.imap(scan_file_in_worker, final_files, chunksize=8):
+                secret_records.extend(file_records)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        rules = compile_secrets_rules(raw_regex_rules, common_passwords_list)
+        for candidate in final_files:
+            secret_records.extend(scan_candidate_file(args, base_path, candidate, rules, cache))
+
+    if args.secrets_history:
+        logging.info("Scanning git history for secrets")
+        rules = compile_secrets_rules(raw_regex_rules, common_passwords_list)
+        secret_records.extend(scan_history_for_secrets(args, local_path, base_path, rules, combine_patterns(include_patterns), combine_patterns(exclude_patterns)))
+
+    if cache is not None:
+        lib_utils.prune_cache(cache['path'], args.cache_max_age, args.cache_max_size)
+    return secret_records
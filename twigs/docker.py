@@ -6,15 +6,19 @@ import tempfile
 import shutil
 import stat
 import tarfile
+import posixpath
 import re
 import traceback
 import json
 import pkg_resources
 import importlib
 import io
+import copy
+import hashlib
 
 from . import utils
 from . import repo 
+from . import rpmdb
 
 docker_cli = ""
 
@@ -29,48 +33,289 @@ def on_rm_error( func, path, exc_info):
     os.chmod( path, stat.S_IWRITE )
     os.unlink( path )
 
-def tar_available():
-    if os.path.isfile("/bin/tar"):
-        return "/bin/tar"
-    elif os.path.isfile("/usr/bin/tar"):
-        return "/usr/bin/tar"
-    return None
+# Files of the container filesystem which are read by the discovery, everything else in the
+# layers is skipped. Manifest files are those of repo.MANIFEST_FILE_SUFFIXES.
+OS_RELEASE_FILES = ['etc/os-release', 'etc/redhat-release', 'usr/lib/os-release']
+PACKAGE_DB_FILES = ['var/lib/dpkg/status', 'lib/apk/db/installed']
+RPM_DB_DIRS = ['var/lib/rpm', 'usr/lib/sysimage/rpm']
+WHITEOUT_PREFIX = '.wh.'
+WHITEOUT_OPAQUE = '.wh..wh..opq'
+LAYER_CACHE_VERSION = 1
+
+def is_wanted_file(path):
+    if path in OS_RELEASE_FILES or path in PACKAGE_DB_FILES or path in RPM_DB_DIRS:
+        return True
+    if posixpath.dirname(path) in RPM_DB_DIRS:
+        return True
+    return path.endswith(tuple(repo.MANIFEST_FILE_SUFFIXES))
+
+class ExtractedFiles(set):
+    # Paths of the files extracted so far, indexed by directory so the files under a directory
+    # are found without going through all of them
+    def __init__(self):
+        set.__init__(self)
+        self.children = { } # directory -> paths of the files and directories in it
+
+    def add(self, path):
+        if path in self:
+            return
+        set.add(self, path)
+        child = path
+        while True:
+            parent = posixpath.dirname(child)
+            if parent in self.children:
+                self.children[parent].add(child)
+                return
+            self.children[parent] = set([child])
+            if parent == '':
+                return
+            child = parent
+
+    def remove(self, path):
+        set.remove(self, path)
+        if path not in self.children: # still listed as a directory otherwise
+            self.children[posixpath.dirname(path)].discard(path)
+
+    def files_under(self, dir_path):
+        files = []
+        dirs = [dir_path]
+        while len(dirs) > 0:
+            for child in self.children.get(dirs.pop(), ()):
+                if child in self:
+                    files.append(child)
+                if child in self.children:
+                    dirs.append(child)
+        return files
+
+def remove_extracted(container_fs, extracted, path, keep, recursive=True):
+    # Removes path (and the files under it if recursive) extracted from lower layers
+    paths = [path] if path in extracted else []
+    if recursive:
+        paths.extend(extracted.files_under(path))
+    for extracted_path in paths:
+        if extracted_path in keep:
+            continue
+        extracted.remove(extracted_path)
+        try:
+            os.remove(os.path.join(container_fs, *extracted_path.split('/')))
+        except OSError:
+            pass
+
+def extract_layer_member(layer_tf, member, container_fs, path, extracted):
+    if member.issym():
+        if member.linkname.startswith('/'):
+            target = posixpath.normpath(member.linkname.lstrip('/'))
+        else:
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(path), member.linkname))
+        if target == '..' or target.startswith('../'):
+            return False
+    dest = os.path.join(container_fs, *path.split('/'))
+    parent = os.path.dirname(dest)
+    real_fs = os.path.realpath(container_fs)
+    if os.path.commonprefix([os.path.realpath(parent) + os.sep, real_fs + os.sep]) != real_fs + os.sep:
+        logging.debug("Skipping [%s] which resolves outside the container filesystem", path)
+        return False
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    if os.path.lexists(dest):
+        if os.path.isdir(dest) and not os.path.islink(dest):
+            return False
+        os.remove(dest)
+    if member.isreg():
+        with layer_tf.extractfile(member) as src_fd:
+            with open(dest, 'wb') as dest_fd:
+                shutil.copyfileobj(src_fd, dest_fd)
+    elif member.issym():
+        # links are made relative, so they resolve inside the container filesystem
+        os.symlink(os.path.relpath(os.path.join(container_fs, *target.split('/')), parent), dest)
+    elif member.islnk():
+        target = posixpath.normpath(member.linkname.lstrip('/'))
+        if target not in extracted:
+            return False
+        shutil.copyfile(os.path.join(container_fs, *target.split('/')), dest)
+    else:
+        return False
+    return True
 
-def untar(tar_file, untar_directory):
-    tar_cmd = tar_available()
-    if tar_cmd is not None:
-        tar_cmd_failed = False
-        cmdarr = [tar_cmd + ' -C ' + untar_directory + ' -xvf ' + tar_file]
-        out = ''
+def add_cached_layer_member(cache_tf, layer_tf, member, path, container_fs, is_extracted):
+    # Returns False if the member could not be added, the layer is then not cached
+    cached = copy.copy(member)
+    cached.name = path
+    cached.pax_headers = { }
+    try:
+        if not member.isreg() or member.size == 0 or posixpath.basename(path).startswith(WHITEOUT_PREFIX):
+            cached.size = 0
+            cache_tf.addfile(cached)
+        elif is_extracted:
+            with open(os.path.join(container_fs, *path.split('/')), 'rb') as fd:
+                cache_tf.addfile(cached, fd)
+        else:
+            cache_tf.addfile(cached, layer_tf.extractfile(member))
+    except (IOError, OSError) as e:
+        logging.warning("Unable to add [%s] to the layer cache: %s", path, e)
+        return False
+    return True
+
+def extract_layer(layer_fd, container_fs, extracted, cache_tf=None):
+    # Streams the layer tar (possibly compressed) from layer_fd, extracting only the wanted files
+    # and applying its whiteouts to the files in extracted, the paths extracted from lower layers.
+    # The members which matter (wanted files and whiteouts) are also added to cache_tf if specified,
+    # extracting that tar instead of the layer gives the same result. Returns False if that failed.
+    layer_paths = set()
+    cached = cache_tf is not None
+    with tarfile.open(fileobj=layer_fd, mode='r|*') as layer_tf:
+        for member in layer_tf:
+            path = posixpath.normpath(member.name).lstrip('/')
+            if path == '.' or path == '..' or path.startswith('../'):
+                continue
+            dir_path, name = posixpath.split(path)
+            if name.startswith(WHITEOUT_PREFIX):
+                if name == WHITEOUT_OPAQUE:
+                    remove_extracted(container_fs, extracted, dir_path, layer_paths)
+                else:
+                    remove_extracted(container_fs, extracted, posixpath.join(dir_path, name[len(WHITEOUT_PREFIX):]), layer_paths)
+                if cached:
+                    cached = add_cached_layer_member(cache_tf, layer_tf, member, path, container_fs, False)
+                continue
+            if path in extracted and path not in layer_paths:
+                remove_extracted(container_fs, extracted, path, layer_paths, False) # replaced by this layer
+            if not is_wanted_file(path):
+                continue
+            is_extracted = False
+            if not member.isdir():
+                try:
+                    is_extracted = extract_layer_member(layer_tf, member, container_fs, path, extracted)
+                except (IOError, OSError) as e:
+                    logging.debug("Unable to extract [%s]: %s", path, e)
+                if is_extracted:
+                    extracted.add(path)
+                    layer_paths.add(path)
+            if cached:
+                cached = add_cached_layer_member(cache_tf, layer_tf, member, path, container_fs, is_extracted)
+    return cached
+
+def get_layer_cache(args):
+    if args.cache_dir is None:
+        return None
+    cache_path = os.path.join(args.cache_dir, 'layers')
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    return cache_path
+
+def get_cached_layer_file(cache_path, diff_id):
+    # Cached layers hold only the files selected by is_wanted_file, so the selection is part of the key
+    if re.match(r'^[a-z0-9]+:[a-f0-9]+$', diff_id) is None:
+        return None
+    selection = json.dumps([LAYER_CACHE_VERSION, OS_RELEASE_FILES, PACKAGE_DB_FILES, RPM_DB_DIRS, repo.MANIFEST_FILE_SUFFIXES])
+    selection = hashlib.sha256(selection.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_path, diff_id.replace(':', '-') + '-' + selection + '.tar')
+
+def extract_cached_layer(cache_file, container_fs, extracted):
+    with open(cache_file, 'rb') as fd:
+        extract_layer(fd, container_fs, extracted)
+    os.utime(cache_file, None) # mark as recently used
+
+def extract_image_layer(image_tf, layer, cache_file, container_fs, extracted):
+    # Returns False if the cached layer could not be read, it is removed then and the layers
+    # extracted so far have to be extracted again
+    if cache_file is None:
+        extract_layer(image_tf.extractfile(layer), container_fs, extracted)
+        return True
+    if os.path.isfile(cache_file):
         try:
-            out = subprocess.check_output(cmdarr, shell=True)
-            return
-        except subprocess.CalledProcessError:
-            logging.error("Unable to untar container image tar file")
-            tar_failed = True
+            extract_cached_layer(cache_file, container_fs, extracted)
+            return True
+        except (IOError, OSError, tarfile.TarError) as e:
+            logging.warning("Unable to read cached layer [%s]: %s", cache_file, e)
+            try:
+                os.remove(cache_file)
+            except OSError:
+                pass
+            return False
+    temp_file = cache_file + '.' + str(os.getpid())
+    try:
+        cache_tf = tarfile.open(temp_file, 'w')
+    except (IOError, OSError) as e:
+        logging.warning("Unable to cache layer [%s]: %s", cache_file, e)
+        extract_layer(image_tf.extractfile(layer), container_fs, extracted)
+        return True
+    try:
+        cached = extract_layer(image_tf.extractfile(layer), container_fs, extracted, cache_tf)
+        try:
+            cache_tf.close()
+            if cached:
+                os.replace(temp_file, cache_file)
+        except (IOError, OSError) as e:
+            logging.warning("Unable to cache layer [%s]: %s", cache_file, e)
+    finally:
+        cache_tf.close()
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
+    return True
+
+def extract_image_layers(image_tf, layers, cache_files, container_fs):
+    # Returns the cache file which could not be read, if any
+    extracted = ExtractedFiles()
+    for layer, cache_file in zip(layers, cache_files):
+        if not extract_image_layer(image_tf, layer, cache_file, container_fs, extracted):
+            return cache_file
+    return None
+
+def get_image_layers(args):
+    # Returns the diff ids of the layers of the image, in order
+    cmdarr = [docker_cli, "image", "inspect", "--format", "{{json .RootFS.Layers}}", args.image]
+    try:
+        out = subprocess.check_output(cmdarr)
+        return json.loads(out.decode(args.encoding))
+    except (subprocess.CalledProcessError, ValueError):
+        logging.warning("Unable to get layers of image: "+args.image)
+        return None
 
-    if tar_cmd is None or tar_failed:
-        with tarfile.open(tar_file, 'r', format=tarfile.PAX_FORMAT) as tf:
-            tf.extractall(path=untar_directory)
+def get_cached_container_fs(args, working_dir, cache_path):
+    # Composes the container filesystem from the layer cache if all the layers of the image are
+    # cached, so the image need not be saved
+    diff_ids = get_image_layers(args)
+    if diff_ids is None or len(diff_ids) == 0:
+        return None
+    cache_files = [get_cached_layer_file(cache_path, diff_id) for diff_id in diff_ids]
+    if None in cache_files or not all([os.path.isfile(f) for f in cache_files]):
+        return None
+    logging.info("Using cached contents of all %d layers of image", len(cache_files))
+    container_fs = working_dir + os.path.sep + 'container_fs'
+    os.mkdir(container_fs)
+    extracted = ExtractedFiles()
+    try:
+        for cache_file in cache_files:
+            extract_cached_layer(cache_file, container_fs, extracted)
+    except (IOError, OSError, tarfile.TarError) as e:
+        # likely pruned by a concurrent run, fall back to saving the image
+        logging.warning("Unable to read cached layers: %s", e)
+        shutil.rmtree(container_fs, onerror = on_rm_error)
+        return None
+    return container_fs
 
-def get_container_fs(container_tar):
+def get_container_fs(container_tar, cache_path=None):
     if container_tar is None:
         return None
     working_dir = os.path.dirname(container_tar)
-    container_dir = working_dir + os.path.sep + 'container'
-    os.mkdir(container_dir)
-    untar(container_tar, container_dir)
     container_fs = working_dir + os.path.sep + 'container_fs'
     os.mkdir(container_fs)
-    layers = []
-    with open(container_dir + os.path.sep + 'manifest.json', 'r') as fd:
-        manifest_json = json.load(fd)
+    # the image tar is read in place, its layers are streamed from it (or the cache) in order
+    with tarfile.open(container_tar, 'r') as image_tf:
+        manifest_json = json.load(image_tf.extractfile('manifest.json'))
         layers = manifest_json[0]['Layers']
-    for layer in layers:
-        layer_tar = container_dir + os.path.sep + layer
-        untar(layer_tar, container_fs)
+        cache_files = [None] * len(layers)
+        if cache_path is not None:
+            config_json = json.load(image_tf.extractfile(manifest_json[0]['Config']))
+            cache_files = [get_cached_layer_file(cache_path, diff_id) for diff_id in config_json['rootfs']['diff_ids']]
+        bad_cache_file = extract_image_layers(image_tf, layers, cache_files, container_fs)
+        while bad_cache_file is not None:
+            # start over without the cached layer which could not be read
+            shutil.rmtree(container_fs, onerror = on_rm_error)
+            os.mkdir(container_fs)
+            cache_files = [None if f == bad_cache_file else f for f in cache_files]
+            bad_cache_file = extract_image_layers(image_tf, layers, cache_files, container_fs)
     os.remove(container_tar)
-    shutil.rmtree(container_dir, onerror = on_rm_error)
     return container_fs
 
 def unpack_container_fs(container_tar):
@@ -79,7 +324,8 @@ def unpack_container_fs(container_tar):
     working_dir = os.path.dirname(container_tar)
     container_fs = working_dir + os.path.sep + 'container_fs'
     os.mkdir(container_fs)
-    untar(container_tar, container_fs)
+    with open(container_tar, 'rb') as fd:
+        extract_layer(fd, container_fs, ExtractedFiles())
     os.remove(container_tar)
     return container_fs
 
@@ -222,6 +468,17 @@ def get_os_release_from_container_image(args, container_fs):
     return None
 
 def discover_rh_from_container_image(container_fs):
+    for dbpath in RPM_DB_DIRS:
+        packages = rpmdb.read_packages(os.path.join(container_fs, *dbpath.split('/')))
+        if packages is not None:
+            plist = utils.ProductList()
+            for name, version, release, arch in packages:
+                plist.append(("%s %s-%s.%s" % (name, version, release, arch)).strip())
+            return plist
+    # fall back to the rpm python bindings for databases which cannot be read natively
+    return discover_rh_with_rpm_module(container_fs)
+
+def discover_rh_with_rpm_module(container_fs):
     # Load rpm module programmatically to avoid display warning message if distro package
     # is not installed in other discovery modes
     try:
@@ -239,7 +496,7 @@ def discover_rh_from_container_image(container_fs):
     if hasattr(rpm_module, 'addMacro') == False:
             logging.warning('Please install [python2-rpm] or [python3-rpm] from your distro package manager')
             return []
-    plist = []
+    plist = utils.ProductList()
     rpm_addMacro = getattr(rpm_module, 'addMacro')
     rpm_addMacro("_dbpath", container_fs + os.path.sep + os.path.sep.join(["var","lib","rpm"]))
     rpm_TS = getattr(rpm_module, 'TransactionSet')
@@ -252,7 +509,7 @@ def discover_rh_from_container_image(container_fs):
 
 def discover_ubuntu_from_container_image(container_fs):
     dpkg_status_file = container_fs + os.path.sep + os.path.sep.join(["var","lib","dpkg","status"])
-    plist = []
+    plist = utils.ProductList()
     pkg = ''
     ver = ''
     with io.open(dpkg_status_file, 'r', errors='ignore') as fd:
@@ -261,8 +518,7 @@ def discover_ubuntu_from_container_image(container_fs):
             if not line:
                 if pkg != '':
                     pkg_ver = pkg + ' ' + ver
-                    if pkg_ver not in plist:
-                        plist.append(pkg_ver)
+                    plist.add(pkg_ver)
                 break
             line = line.strip()
             if line == '':
@@ -277,7 +533,7 @@ def discover_ubuntu_from_container_image(container_fs):
 
 def discover_alpine_from_container_image(container_fs):
     apkg_status_file = container_fs + os.path.sep + os.path.sep.join(["lib","apk","db","installed"])
-    plist = []
+    plist = utils.ProductList()
     pkg = ''
     ver = ''
     with io.open(apkg_status_file, 'r', errors='ignore') as fd:
@@ -286,8 +542,7 @@ def discover_alpine_from_container_image(container_fs):
             if not line:
                 if pkg != '':
                     pkg_ver = pkg + ' ' + ver
-                    if pkg_ver not in plist:
-                        plist.append(pkg_ver)
+                    plist.add(pkg_ver)
                 break
             line = line.strip()
             if line == '':
@@ -321,8 +576,15 @@ def discover_container_from_image(args):
         temp_dir = make_temp_directory(args.tmp_dir)
         logging.info("Retrieving container filesystem")
         if args.image is not None:
-            container_tar = save_image(args, temp_dir)
-            container_fs = get_container_fs(container_tar)
+            cache_path = get_layer_cache(args)
+            container_fs = None
+            if cache_path is not None:
+                container_fs = get_cached_container_fs(args, temp_dir, cache_path)
+            if container_fs is None:
+                container_tar = save_image(args, temp_dir)
+                container_fs = get_container_fs(container_tar, cache_path)
+            if cache_path is not None:
+                utils.prune_cache(cache_path, args.cache_max_age, args.cache_max_size)
         else:
             container_tar = export_container(args, temp_dir)
             container_fs = unpack_container_fs(container_tar)
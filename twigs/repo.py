@@ -13,7 +13,16 @@ import traceback
 import requirements
 import re
 import zipfile
+import io
+import hashlib
+import time
+import multiprocessing
+import multiprocessing.connection
+import signal
+import copy
 from xml.dom import minidom
+from urllib.parse import urlsplit, urlunsplit
+from xml.etree import ElementTree
 import toml
 import re
 
@@ -21,14 +30,68 @@ from . import utils as lib_utils
 from . import code_secrets as lib_code_secrets
 from . import sast
 
-GIT_PATH = os.environ.get('GIT_PATH')
-if GIT_PATH is None:
-    if os.name == 'nt':
-        GIT_PATH = 'C:\\Program Files\\Git\\cmd\\git.exe'
-    else:
-        GIT_PATH = '/usr/bin/git'
+GIT_PATH = lib_utils.GIT_PATH
 
 SUPPORTED_TYPES = ['pip', 'ruby', 'yarn', 'nuget', 'npm', 'maven', 'gradle', 'dll', 'jar', 'cargo']
+# Types whose products only depend on the content of the manifest file, which are cached with --cache_dir
+CACHED_TYPES = ['pip', 'ruby', 'yarn', 'nuget', 'npm', 'gradle', 'cargo']
+MANIFEST_CACHE_VERSION = 1
+
+# File name suffixes looked up by the discover_* functions
+MANIFEST_FILE_SUFFIXES = ['requirements.txt', 'gemfile.lock', 'Gemfile.lock', 'yarn.lock', 'package.json',
+        'packages.config', 'package-lock.json', 'pom.xml', 'dependencies.gradle', '.dll', '.jar', '.war', '.ear', 'Cargo.toml']
+# Java archives inspected by discover_jar, nested ones are inspected up to JAR_MAX_DEPTH levels
+JAR_FILE_SUFFIXES = ('.jar', '.war', '.ear')
+JAR_MAX_DEPTH = 3
+
+# package.json / package-lock.json files larger than this are streamed instead of loaded
+PACKAGE_JSON_STREAM_SIZE = 32 * 1024 * 1024
+
+changed_files_cache = { }
+file_index_cache = { }
+pom_cache = { }
+
+def run_git_cmd(path, cmdarr):
+    out = subprocess.check_output([GIT_PATH] + cmdarr, cwd=path)
+    return out.decode('utf-8')
+
+def get_changed_files(args, localpath):
+    # Returns the absolute paths of files changed (added / modified / untracked) and deleted
+    # in the working tree at localpath since the commit specified with --since
+    localpath = os.path.abspath(localpath)
+    if localpath in changed_files_cache:
+        return changed_files_cache[localpath]
+    changed_files = set()
+    deleted_files = set()
+    out = run_git_cmd(localpath, ['diff', '--name-status', '--no-renames', '--relative', '-z', args.since])
+    tokens = out.split('\0')
+    for index in range(0, len(tokens) - 1, 2):
+        file_path = os.path.join(localpath, tokens[index + 1])
+        if tokens[index].startswith('D'):
+            deleted_files.add(file_path)
+        else:
+            changed_files.add(file_path)
+    out = run_git_cmd(localpath, ['ls-files', '--others', '--exclude-standard', '-z'])
+    for token in out.split('\0'):
+        if len(token) > 0:
+            changed_files.add(os.path.join(localpath, token))
+    changed_files_cache[localpath] = (changed_files, deleted_files)
+    return changed_files, deleted_files
+
+def find_all_repo_files(localpath, filename):
+    # All discoverers share a single walk of localpath, see discover_inventory
+    file_index = file_index_cache.get(os.path.abspath(localpath))
+    if file_index is not None and filename in file_index:
+        return file_index[filename]
+    return lib_utils.find_files(localpath, filename)
+
+def find_repo_files(args, localpath, filename):
+    files = find_all_repo_files(localpath, filename)
+    if args.since is None:
+        return files
+    # Incremental mode, only files changed since the specified commit are considered
+    changed_files, deleted_files = get_changed_files(args, localpath)
+    return [f for f in files if os.path.abspath(f) in changed_files]
 
 def cleanse_semver_version(pv):
     pv = pv.replace('"','')
@@ -46,9 +109,8 @@ def cleanse_semver_version(pv):
         pv = temp_tokens[0] + ' ' + version
     return pv
 
-def discover_cargo_toml(args, localpath):
-    plist = []
-    files = lib_utils.find_files(localpath, 'Cargo.toml')
+def discover_cargo_toml(args, localpath, files):
+    plist = lib_utils.ProductList()
     prop_dict = None
     for file_path in files:
         fp = open(file_path, 'r')
@@ -75,90 +137,153 @@ def discover_cargo_toml(args, localpath):
                 plist.append(prod)
     return plist, None
 
-def discover_pom_xml(args, localpath):
-    plist = []
-    files = lib_utils.find_files(localpath, 'pom.xml')
-    prop_dict = None
-    for file_path in files:
-        fp = open(file_path, 'r')
-        if fp == None:
+def get_xml_tag(elem):
+    # Tag name without the namespace
+    tag = elem.tag
+    if not isinstance(tag, str):
+        return None # comments and processing instructions
+    if tag.startswith('{'):
+        tag = tag[tag.index('}')+1:]
+    return tag
+
+def parse_pom_file(file_path):
+    # Reads the coordinates, parent, properties and dependencies of a pom.xml in a single
+    # streaming pass, dropping elements once they have been processed
+    pom = {'groupId': None, 'artifactId': None, 'version': None, 'parent': None, 'properties': { }, 'dependencies': []}
+    path = []
+    dependency = None
+    for event, elem in ElementTree.iterparse(file_path, events=('start', 'end')):
+        tag = get_xml_tag(elem)
+        if event == 'start':
+            path.append(tag)
+            if tag == 'dependency':
+                dependency = { }
+            elif path == ['project', 'parent']:
+                pom['parent'] = {'relativePath': '../pom.xml'}
             continue
-        contents = fp.read()
-        xmldoc = None
+        path.pop()
+        if len(path) == 0:
+            break
+        text = elem.text.strip() if elem.text is not None else ''
+        parent_tag = path[-1]
+        if len(path) == 1 and tag in ['groupId', 'artifactId', 'version']:
+            pom[tag] = text
+        elif path == ['project', 'parent'] and tag in ['groupId', 'artifactId', 'version', 'relativePath']:
+            pom['parent'][tag] = text
+        elif parent_tag == 'properties':
+            pom['properties'][tag] = text
+        elif parent_tag == 'dependency' and dependency is not None and tag in ['groupId', 'artifactId', 'version']:
+            dependency[tag] = text
+        elif tag == 'dependency':
+            if dependency is not None and dependency.get('artifactId'):
+                pom['dependencies'].append(dependency)
+            dependency = None
+        elem.clear() # everything needed from the element has been read
+    return pom
+
+def get_pom(file_path):
+    # Parsed pom.xml, cached by path and modification time so a parent shared by many modules is
+    # parsed once. None if the file can not be parsed.
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    key = (file_path, st.st_mtime, st.st_size)
+    if key not in pom_cache:
         try:
-            xmldoc = minidom.parseString(contents)
+            pom_cache[key] = parse_pom_file(file_path)
         except Exception:
-            logging.error("Unable to parse pom.xml")
-            return None
-        if prop_dict is None:
-            prop_dict = { }
-            curr_prop_dict = prop_dict
-        else:
-            curr_prop_dict = prop_dict.copy()
+            logging.error("Unable to parse pom.xml [%s]", file_path)
+            pom_cache[key] = None
+    return pom_cache[key]
 
-        version_elements = xmldoc.getElementsByTagName('version')
-        for ve in version_elements:
-            if ve.parentNode.nodeName == 'project':
-                curr_prop_dict['project.version'] = ve.childNodes[0].data
+def get_parent_pom_path(file_path, pom):
+    # Local path of the parent pom, as resolved by maven through relativePath
+    parent = pom['parent']
+    if parent is None or len(parent.get('relativePath', '')) == 0:
+        return None
+    parent_path = os.path.normpath(os.path.join(os.path.dirname(file_path), parent['relativePath']))
+    if os.path.isdir(parent_path):
+        parent_path = os.path.join(parent_path, 'pom.xml')
+    if parent_path == os.path.normpath(file_path) or not os.path.isfile(parent_path):
+        return None
+    parent_pom = get_pom(parent_path)
+    if parent_pom is None or parent_pom['artifactId'] != parent.get('artifactId'):
+        return None
+    parent_group = parent_pom['groupId'] or (parent_pom['parent'] or { }).get('groupId')
+    if parent.get('groupId') is not None and parent_group != parent.get('groupId'):
+        return None
+    return parent_path
+
+def get_pom_properties(file_path, pom, visited=None):
+    # Properties of the pom including the ones inherited from its parent poms
+    if visited is None:
+        visited = set()
+    visited.add(os.path.normpath(file_path))
+    properties = { }
+    parent = pom['parent'] or { }
+    parent_path = get_parent_pom_path(file_path, pom)
+    if parent_path is not None and os.path.normpath(parent_path) not in visited:
+        properties.update(get_pom_properties(parent_path, get_pom(parent_path), visited))
+    for key in ['groupId', 'version']:
+        if parent.get(key):
+            properties['project.parent.' + key] = parent[key]
+    group_id = pom['groupId'] or parent.get('groupId')
+    version = pom['version'] or parent.get('version')
+    if group_id:
+        properties['project.groupId'] = group_id
+    if pom['artifactId']:
+        properties['project.artifactId'] = pom['artifactId']
+    if version:
+        properties['project.version'] = version
+    properties.update(pom['properties'])
+    return properties
+
+def resolve_pom_value(value, properties):
+    # Substitutes the ${...} references in value, leaving unknown references as is
+    for i in range(10): # properties referring to properties, up to some depth
+        start = value.find('${')
+        if start == -1:
+            break
+        resolved = ''
+        index = 0
+        while start != -1:
+            end = value.find('}', start)
+            if end == -1:
                 break
+            prop_value = properties.get(value[start+2:end])
+            resolved = resolved + value[index:start] + (prop_value if prop_value is not None else value[start:end+1])
+            index = end + 1
+            start = value.find('${', index)
+        resolved = resolved + value[index:]
+        if resolved == value:
+            break
+        value = resolved
+    return value
 
-        prop_list = xmldoc.getElementsByTagName('properties')
-        if len(prop_list) > 0:
-            for p in prop_list:
-                for item in p.childNodes:
-                    if item.nodeType == item.TEXT_NODE or item.nodeType == item.COMMENT_NODE or len(item.childNodes) == 0:
-                        continue
-                    prop_name = item.nodeName
-                    prop_value = item.childNodes[0].data
-                    if prop_value.startswith('${'):
-                        # Try to look-up value from prop_dict
-                        lookup_prop = prop_value[2:-1]
-                        prop_value = prop_dict.get(lookup_prop)
-                    if prop_value is not None:
-                        curr_prop_dict[prop_name] = prop_value
-
-        dlist = xmldoc.getElementsByTagName('dependency')
-        for d in dlist:
-            gid = d.getElementsByTagName('groupId')
-            if len(gid) == 0:
-                gid = None
-            else:
-                gid = gid[0]
-            aid = d.getElementsByTagName('artifactId')
-            if len(aid) == 0:
-                continue
-            else:
-                aid = aid[0]
-            ver = d.getElementsByTagName('version')
-            if len(ver) == 0:
-                ver = None 
-            else:
-                ver = ver[0]
-            libgname = ''
-            if gid != None:
-                libgname = gid.childNodes[0].data
-            libname = aid.childNodes[0].data
-            libver = ''
-            if ver != None:
-                libver = ver.childNodes[0].data
-                if libver.startswith('${'):
-                    prop_value = curr_prop_dict.get(libver[2:-1])
-                    if prop_value is not None:
-                        libver = prop_value
+def discover_pom_xml(args, localpath, files):
+    plist = lib_utils.ProductList()
+    for file_path in files:
+        pom = get_pom(file_path)
+        if pom is None:
+            continue # other files are still processed
+        properties = get_pom_properties(file_path, pom)
+        if localpath.startswith('/tmp/'):
+            file_path = file_path.replace(localpath+'/','')
+        for dependency in pom['dependencies']:
+            libgname = resolve_pom_value(dependency.get('groupId', ''), properties)
+            libname = resolve_pom_value(dependency['artifactId'], properties)
+            libver = resolve_pom_value(dependency.get('version', ''), properties)
             if libgname == '':
                 pname = libname + ' ' + libver
             else:
                 pname = libgname + ':' + libname + ' ' + libver
-            if localpath.startswith('/tmp/'):
-                file_path = file_path.replace(localpath+'/','')
             pname = pname.strip() + " source:"+file_path
-            if pname not in plist:
-                plist.append(pname)
+            plist.add(pname)
     return plist, None
 
-def discover_gradle(args, localpath):
-    plist = []
-    files = lib_utils.find_files(localpath, 'dependencies.gradle')
+def discover_gradle(args, localpath, files):
+    plist = lib_utils.ProductList()
     for file_path in files:
         fp = open(file_path, 'r')
         if fp == None:
@@ -174,97 +299,161 @@ def discover_gradle(args, localpath):
                     file_path = file_path.replace(localpath+'/','')
                 pname = gname + ':' + lname + ' ' + ver + " source:"+file_path
                 pname = pname.replace("'","")
-                if pname not in plist:
-                    plist.append(pname)
+                plist.add(pname)
     return plist, None
 
+def read_package_dependency(tokens, token, keep_keys):
+    # Reads a dependency entry keeping only keep_keys, so nested dependency trees are not built
+    if token != '{':
+        return lib_utils.read_json_value(tokens, token)
+    entry = { }
+    for key in lib_utils.iter_json_object(tokens):
+        if key in keep_keys:
+            entry[key] = lib_utils.read_json_value(tokens, lib_utils.next_json_token(tokens))
+        else:
+            lib_utils.skip_json_value(tokens, lib_utils.next_json_token(tokens))
+    return entry
+
+def get_package_name(package_path):
+    # Package name for a key of the lockfileVersion 2/3 packages map, None for the root
+    # package, nested packages and workspace folders
+    if not package_path.startswith('node_modules/'):
+        return None
+    name = package_path[len('node_modules/'):]
+    if '/node_modules/' in name:
+        return None
+    return name
+
+def get_dependency_products(d, content, level, file_path):
+    # Products of an entry of the dependencies map of package.json / package-lock.json
+    if not isinstance(content, dict):
+        pname = d + ' ' + content + " source:"+file_path
+        return [(cleanse_semver_version(pname), True)]
+    products = [(d + ' ' + content['version'] + " source:"+file_path, True)]
+    req_dict = content.get('requires')
+    if req_dict is not None and level != 'shallow':
+        for req_pname in req_dict:
+            products.append((req_pname + ' ' + req_dict[req_pname] + " source:"+file_path, False))
+    return products
+
+def get_package_products(package_path, content, level, file_path):
+    # Products of an entry of the lockfileVersion 2/3 packages map, only its top level
+    # node_modules entries are used
+    name = get_package_name(package_path)
+    if name is None or not isinstance(content, dict) or 'version' not in content:
+        return []
+    products = [(name + ' ' + content['version'] + " source:"+file_path, True)]
+    req_dict = content.get('dependencies')
+    if req_dict is not None and level != 'shallow':
+        for req_pname in req_dict:
+            products.append((req_pname + ' ' + req_dict[req_pname] + " source:"+file_path, False))
+    return products
+
+def get_extra_dependency_products(ddict, file_path):
+    # Products of the devDependencies / optionalDependencies maps
+    products = []
+    for d in ddict:
+        pname = d + ' ' + ddict[d]
+        products.append((cleanse_semver_version(pname) + " source:"+file_path, True))
+    return products
+
+def get_package_json_products(cjson, level, file_path):
+    products = [] # (pname, 1st level dependency)
+    if not isinstance(cjson, dict):
+        return products
+    if 'name' in cjson and 'version' in cjson:
+        products.append((cjson['name'] + ' ' + cjson['version'] + " source:"+file_path, True))
+    if 'dependencies' in cjson:
+        ddict = cjson['dependencies']
+        for d in ddict:
+            products.extend(get_dependency_products(d, ddict[d], level, file_path))
+    elif 'packages' in cjson:
+        # lockfileVersion 3 only has the packages map
+        pdict = cjson['packages']
+        for package_path in pdict:
+            products.extend(get_package_products(package_path, pdict[package_path], level, file_path))
+    for key in ['devDependencies', 'optionalDependencies']:
+        if key in cjson:
+            products.extend(get_extra_dependency_products(cjson[key], file_path))
+    return products
+
+def stream_package_json_products(fd, level, file_path):
+    # Same products as get_package_json_products, with the entries of the dependency maps turned
+    # into products as they are read, so the parsed JSON of the file is never held in memory
+    sections = { }
+    tokens = lib_utils.iter_json_tokens(fd)
+    token = next(tokens, None)
+    if token is None:
+        return [] # empty file
+    if token != '{':
+        lib_utils.skip_json_value(tokens, token)
+        if next(tokens, None) is not None:
+            raise ValueError("Extra data after JSON value")
+        return []
+    for key in lib_utils.iter_json_object(tokens):
+        token = lib_utils.next_json_token(tokens)
+        if key in ['name', 'version']:
+            sections[key] = lib_utils.read_json_value(tokens, token)
+        elif key == 'dependencies' and token == '{':
+            products = []
+            for d in lib_utils.iter_json_object(tokens):
+                content = read_package_dependency(tokens, lib_utils.next_json_token(tokens), ['version', 'requires'])
+                products.extend(get_dependency_products(d, content, level, file_path))
+            sections[key] = products
+            sections.pop('packages', None) # only used without dependencies
+        elif key == 'packages' and token == '{' and 'dependencies' not in sections:
+            products = []
+            for package_path in lib_utils.iter_json_object(tokens):
+                content = read_package_dependency(tokens, lib_utils.next_json_token(tokens), ['version', 'dependencies'])
+                products.extend(get_package_products(package_path, content, level, file_path))
+            sections[key] = products
+        elif key in ['devDependencies', 'optionalDependencies']:
+            sections[key] = get_extra_dependency_products(lib_utils.read_json_value(tokens, token), file_path)
+        else:
+            lib_utils.skip_json_value(tokens, token)
+    if next(tokens, None) is not None:
+        raise ValueError("Extra data after JSON value")
+
+    products = []
+    if 'name' in sections and 'version' in sections:
+        products.append((sections['name'] + ' ' + sections['version'] + " source:"+file_path, True))
+    for key in ['dependencies', 'packages', 'devDependencies', 'optionalDependencies']:
+        products.extend(sections.get(key, []))
+    return products
+
+def parse_package_json_file(fd, level, file_path):
+    # Returns the products of the package.json / package-lock.json. Files larger than
+    # PACKAGE_JSON_STREAM_SIZE are streamed, smaller ones are faster to parse with json.
+    if os.fstat(fd.fileno()).st_size > PACKAGE_JSON_STREAM_SIZE:
+        return stream_package_json_products(fd, level, file_path)
+    contents = fd.read().strip()
+    if len(contents) == 0:
+        return [] # empty file
+    return get_package_json_products(json.loads(contents), level, file_path)
+
 def process_package_json_files(files, level, localpath):
-    plist = []
+    plist = lib_utils.ProductList()
     p1list = [] # 1st level dependencies
     for file_path in files:
-        fp = open(file_path, 'r')
-        if fp == None:
-            continue
-        contents = fp.read()
-        contents = contents.strip()
-        if len(contents) == 0:
-            continue
-        cjson = ''
+        source_path = file_path
+        if localpath.startswith('/tmp/'):
+            source_path = file_path.replace(localpath+'/','')
         try:
-            cjson = json.loads(contents)
+            with open(file_path, 'r') as fd:
+                products = parse_package_json_file(fd, level, source_path)
         except Exception:
             logging.error("Unable to parse package.json contents")
             continue
-        if 'name' in cjson and 'version' in cjson:
-            if localpath.startswith('/tmp/'):
-                file_path = file_path.replace(localpath+'/','')
-            pname = cjson['name'] + ' ' + cjson['version'] + " source:"+file_path
-            if pname not in plist:
-                plist.append(pname)
+        for pname, first_level in products:
+            if plist.add(pname) and first_level:
                 p1list.append(pname)
-        if 'dependencies' in cjson:
-            ddict = cjson['dependencies']
-            for d in ddict:
-                content = ddict[d]
-                if isinstance(content, dict):
-                    ver = content['version']
-                    if localpath.startswith('/tmp/'):
-                        file_path = file_path.replace(localpath+'/','')
-                    pname = d + ' ' + ver + " source:"+file_path
-                    if pname not in plist:
-                        plist.append(pname)
-                        p1list.append(pname)
-                    req_dict = content.get('requires')
-                    if req_dict is None or level == 'shallow':
-                        continue
-                    for req_pname in req_dict:
-                        if localpath.startswith('/tmp/'):
-                            file_path = file_path.replace(localpath+'/','')
-                        pname = req_pname + ' ' + req_dict[req_pname] + " source:"+file_path
-                        if pname not in plist:
-                            plist.append(pname)
-                else:
-                    if localpath.startswith('/tmp/'):
-                        file_path = file_path.replace(localpath+'/','')
-                    pname = d + ' ' + ddict[d] + " source:"+file_path
-                    pname = cleanse_semver_version(pname)
-                    if pname not in plist:
-                        plist.append(pname)
-                        p1list.append(pname)
-        if 'devDependencies' in cjson:
-            ddict = cjson['devDependencies']
-            for d in ddict:
-                pname = d + ' ' + ddict[d]
-                if localpath.startswith('/tmp/'):
-                    file_path = file_path.replace(localpath+'/','')
-                pname = cleanse_semver_version(pname) + " source:"+file_path
-                if pname not in plist:
-                    plist.append(pname)
-                    p1list.append(pname)
-        if 'optionalDependencies' in cjson:
-            ddict = cjson['optionalDependencies']
-            for d in ddict:
-                pname = d + ' ' + ddict[d]
-                if localpath.startswith('/tmp/'):
-                    file_path = file_path.replace(localpath+'/','')
-                pname = cleanse_semver_version(pname) + " source:"+file_path
-                if pname not in plist:
-                    plist.append(pname)
-                    p1list.append(pname)
     return plist, p1list 
 
-def discover_package_json(args, localpath):
-    files = lib_utils.find_files(localpath, 'package-lock.json')
-    if len(files) > 0:
-        plist, p1list = process_package_json_files(files, args.level, localpath)
-    else:
-        files = lib_utils.find_files(localpath, 'package.json')
-        plist, p1list = process_package_json_files(files, args.level, localpath)
-    return plist, p1list
+def discover_package_json(args, localpath, files):
+    return process_package_json_files(files, args.level, localpath)
 
-def discover_packages_config(args, localpath):
-    plist = []
-    files = lib_utils.find_files(localpath, 'packages.config')
+def discover_packages_config(args, localpath, files):
+    plist = lib_utils.ProductList()
     for file_path in files:
         fp = open(file_path, 'r')
         if fp == None:
@@ -283,19 +472,12 @@ def discover_packages_config(args, localpath):
             if localpath.startswith('/tmp/'):
                 file_path = file_path.replace(localpath+'/','')
             pname = libname + ' ' + libver + " source:"+file_path
-            if pname not in plist:
-                plist.append(pname)
+            plist.add(pname)
     return plist, None
 
-def discover_yarn(args, localpath):
-    plist = []
+def discover_yarn(args, localpath, files):
+    plist = lib_utils.ProductList()
     p1list = []
-    files = lib_utils.find_files(localpath, 'yarn.lock')
-    if len(files) == 0 and args.type is not None:
-        files = lib_utils.find_files(localpath, 'package.json')
-        plist = process_package_json_files(files, args.level, localpath)
-        return plist
-
     for file_path in files:
         fp = open(file_path, 'r')
         if fp == None:
@@ -317,8 +499,7 @@ def discover_yarn(args, localpath):
                 if localpath.startswith('/tmp/'):
                     file_path = file_path.replace(localpath+'/','')
                 pname = libname+' '+libver + " source:"+file_path
-                if pname not in plist:
-                    plist.append(pname)
+                if plist.add(pname):
                     p1list.append(pname)
             if l.endswith(':') and 'dependencies' in l.lower():
                 dparse = True
@@ -331,16 +512,13 @@ def discover_yarn(args, localpath):
                 if localpath.startswith('/tmp/'):
                     file_path = file_path.replace(localpath+'/','')
                 pname = cleanse_semver_version(pname) + " source:"+file_path
-                if pname not in plist and args.type == 'deep':
-                    plist.append(pname)
+                if args.type == 'deep':
+                    plist.add(pname)
     return plist, p1list
 
-def discover_ruby(args, localpath):
-    pset = set() 
+def discover_ruby(args, localpath, files):
+    plist = lib_utils.ProductList()
     p1list = [] # 1st level dependencies
-    files = lib_utils.find_files(localpath, 'gemfile.lock')
-    if len(files) == 0:
-        files = lib_utils.find_files(localpath, 'Gemfile.lock')
     for file_path in files:
         fp = open(file_path, 'r')
         if fp == None:
@@ -381,14 +559,12 @@ def discover_ruby(args, localpath):
                 if localpath.startswith('/tmp/'):
                     file_path = file_path.replace(localpath+'/','')
                 pname = pname.strip() + " source:"+file_path
-                if pname not in pset:
-                    pset.add(pname)
+                if plist.add(pname):
                     p1list.append(pname)
-    return list(pset) , p1list
+    return plist, p1list
 
-def discover_python(args, localpath):
-    plist = []
-    files = lib_utils.find_files(localpath, 'requirements.txt')
+def discover_python(args, localpath, files):
+    plist = lib_utils.ProductList()
     for file_path in files:
         fp = open(file_path, 'r')
         if fp == None:
@@ -401,8 +577,7 @@ def discover_python(args, localpath):
                     if localpath.startswith('/tmp/'):
                         file_path = file_path.replace(localpath+'/','')
                     prod = prod + ' ' + r.specs[0][1] + " source:"+file_path
-                    if prod not in plist:
-                        plist.append(prod)
+                    plist.add(prod)
         except:
             logging.error("Unable to parse python dependencies")
             continue
@@ -427,9 +602,8 @@ def get_dll_version(path):
         logging.error("Unable to parse DLL file. Skipping.")
         return None
 
-def discover_dll(args, localpath):
-    plist = []
-    files = lib_utils.find_files(localpath, '.dll')
+def discover_dll(args, localpath, files):
+    plist = lib_utils.ProductList()
     for file_path in files:
         dll_version = get_dll_version(file_path)
         if dll_version is None:
@@ -441,72 +615,238 @@ def discover_dll(args, localpath):
         plist.append(dll_details)
     return plist, None
 
-def discover_jar(args, localpath):
+def get_jar_manifest_product(zf):
+    # Returns the product from the Bundle-Name / Bundle-Version of META-INF/MANIFEST.MF
+    try:
+        metafile = zf.read('META-INF/MANIFEST.MF')
+    except KeyError:
+        return None
+    prod = ''
+    ver = ''
+    for l in metafile.decode('utf-8', 'replace').splitlines():
+        if l.startswith("Bundle-Version:"):
+            ver = l.split(':')[1].strip()
+        if l.startswith("Bundle-Name:"):
+            prod = l.split(':')[1].strip().lower().replace(' ','-')
+    if prod == '' or ver == '':
+        return None
+    return prod + ' ' + ver
+
+def get_jar_pom_product(zf, names, jar_name):
+    # Returns the product from META-INF/maven/<groupId>/<artifactId>/pom.properties. Shaded jars
+    # contain one for each of the bundled artifacts, use the one matching the jar name then.
+    pom_props = [n for n in names if n.startswith('META-INF/maven/') and n.endswith('/pom.properties')]
+    candidates = []
+    for name in pom_props:
+        props = { }
+        for l in zf.read(name).decode('utf-8', 'replace').splitlines():
+            if l.startswith('#') or '=' not in l:
+                continue
+            key, value = l.split('=', 1)
+            props[key.strip()] = value.strip()
+        if props.get('artifactId') and props.get('version'):
+            candidates.append((props['artifactId'], props['version']))
+    if len(candidates) > 1:
+        candidates = [c for c in candidates if jar_name.startswith(c[0] + '-' + c[1])]
+    if len(candidates) != 1:
+        return None
+    return candidates[0][0] + ' ' + candidates[0][1]
+
+def get_jar_file_name_product(jar_name):
+    jfile = os.path.splitext(jar_name)[0]
+    pattern = r'(?:(\d+\.(?:\d+\.)*\d+))'
+    match = re.findall(pattern, jfile)
+    if len(match) == 0:
+        return None
+    ver = match[0]
+    prod = jfile.split(ver)[0][:-1]
+    return prod + ' ' + ver
+
+def inspect_jar(jar_file, jar_name, source, depth=0):
+    # Returns the products of the archive jar_file (a path or a file object) and of the archives
+    # nested in it (Spring Boot / WAR / EAR libraries). Only the central directory and the entries
+    # needed are read, nested archives are opened in memory.
     plist = []
-    files = lib_utils.find_files(localpath, '.jar')
+    try:
+        with zipfile.ZipFile(jar_file, 'r') as zf:
+            names = zf.namelist()
+            prod = get_jar_manifest_product(zf)
+            if prod is None:
+                prod = get_jar_pom_product(zf, names, jar_name)
+            if prod is None:
+                prod = get_jar_file_name_product(jar_name)
+            if prod is not None:
+                plist.append(prod.strip() + " source:" + source)
+            if depth >= JAR_MAX_DEPTH:
+                return plist
+            for name in names:
+                if not name.endswith(JAR_FILE_SUFFIXES):
+                    continue
+                nested = io.BytesIO(zf.read(name))
+                plist.extend(inspect_jar(nested, name.rsplit('/', 1)[-1], source + '!/' + name, depth + 1))
+    except (zipfile.BadZipfile, zipfile.LargeZipFile, IOError, OSError, RuntimeError, NotImplementedError) as e:
+        logging.warning("Unable to read archive [%s]: %s", source, e)
+    return plist
+
+def discover_jar(args, localpath, files):
+    plist = lib_utils.ProductList()
     for file_path in files:
-        prod = ''
-        ver = ''
-        #print "Checking "+file_path
-        zf = zipfile.ZipFile(file_path, 'r')
-        try:
-            metafile = zf.read('META-INF/MANIFEST.MF')
-            if metafile:
-                for l in metafile.splitlines():
-                    if l.startswith(b"Bundle-Version:"):
-                        ver = l.split(b':')[1].strip()
-                    if l.startswith(b"Bundle-Name:"):
-                        prod = l.split(b':')[1].strip().lower().replace(b' ',b'-')
-        except KeyError:
-            #print "Error: No manifest found"
-            pass
-        if prod == '' or ver == '':
-            jfile = os.path.basename(file_path)
-            jfile = jfile.replace('.jar','')
-            pattern = r'(?:(\d+\.(?:\d+\.)*\d+))'
-            match = re.findall(pattern, jfile)
-            if len(match) == 0:
-                continue
-            else:
-                ver = match[0]
-                prod = jfile.split(ver)[0][:-1]
-        prod = str(prod) + ' ' + str(ver)
+        source = file_path
         if localpath.startswith('/tmp/'):
-            file_path = file_path.replace(localpath+'/','')
-        prod = prod.strip() + " source:"+file_path
-        if prod != '':
+            source = file_path.replace(localpath+'/','')
+        for prod in inspect_jar(file_path, os.path.basename(file_path), source):
             plist.append(prod)
     return plist, None
 
-def discover_specified_type(repo_type, args, localpath):
-    if repo_type not in SUPPORTED_TYPES:
-        logging.error("Type not supported")
-        return [], None
-
-    plist = []
+def get_manifest_files(repo_type, args, localpath):
+    # Returns the discover function for repo_type and the manifest files it should process. The
+    # fallbacks from lock files to manifests are decided on all the files of the repo, so that
+    # with --since the same kind of files are parsed as in a full scan.
     if repo_type == 'pip':
-        plist, p1list = discover_python(args, localpath)
+        return discover_python, find_repo_files(args, localpath, 'requirements.txt')
     elif repo_type == 'ruby':
-        plist, p1list = discover_ruby(args, localpath)
+        filename = 'gemfile.lock'
+        if len(find_all_repo_files(localpath, filename)) == 0:
+            filename = 'Gemfile.lock'
+        return discover_ruby, find_repo_files(args, localpath, filename)
     elif repo_type == 'yarn':
-        plist, p1list = discover_yarn(args, localpath)
+        if len(find_all_repo_files(localpath, 'yarn.lock')) == 0 and args.type is not None:
+            return discover_package_json, find_repo_files(args, localpath, 'package.json')
+        return discover_yarn, find_repo_files(args, localpath, 'yarn.lock')
     elif repo_type == 'nuget':
-        plist, p1list = discover_packages_config(args, localpath)
+        return discover_packages_config, find_repo_files(args, localpath, 'packages.config')
     elif repo_type == 'npm':
-        plist, p1list = discover_package_json(args, localpath)
+        filename = 'package-lock.json'
+        if len(find_all_repo_files(localpath, filename)) == 0:
+            filename = 'package.json'
+        return discover_package_json, find_repo_files(args, localpath, filename)
     elif repo_type == 'maven':
-        plist, p1list = discover_pom_xml(args, localpath)
+        return discover_pom_xml, find_repo_files(args, localpath, 'pom.xml')
     elif repo_type == 'gradle':
-        plist, p1list = discover_gradle(args, localpath)
+        return discover_gradle, find_repo_files(args, localpath, 'dependencies.gradle')
     elif repo_type == 'dll':
-        plist, p1list = discover_dll(args, localpath)
+        return discover_dll, find_repo_files(args, localpath, '.dll')
     elif repo_type == 'jar':
-        plist, p1list = discover_jar(args, localpath)
+        files = []
+        for suffix in JAR_FILE_SUFFIXES:
+            files.extend(find_repo_files(args, localpath, suffix))
+        return discover_jar, files
     elif repo_type == 'cargo':
-        plist, p1list = discover_cargo_toml(args, localpath)
+        return discover_cargo_toml, find_repo_files(args, localpath, 'Cargo.toml')
+
+def discover_specified_type(repo_type, args, localpath):
+    if repo_type not in SUPPORTED_TYPES:
+        logging.error("Type not supported")
+        return [], None
+
+    if args.cache_dir is not None and repo_type in CACHED_TYPES:
+        # files are looked up in the cache one by one
+        return merge_parse_results([run_parse_task(task) for task in get_parse_tasks(repo_type, args, localpath)])
+    discover_func, files = get_manifest_files(repo_type, args, localpath)
+    return discover_func(args, localpath, files)
+
+def get_parse_tasks(repo_type, args, localpath):
+    # Splits the discovery of repo_type into tasks which can run in parallel, one per manifest file
+    discover_func, files = get_manifest_files(repo_type, args, localpath)
+    if len(files) == 0:
+        return [(discover_func, args, localpath, files, None)]
+    cache_path = get_manifest_cache(args) if repo_type in CACHED_TYPES else None
+    return [(discover_func, args, localpath, [file_path], cache_path) for file_path in files]
+
+def run_parse_task(task):
+    discover_func, args, localpath, files, cache_path = task
+    if cache_path is not None:
+        return parse_manifest_file_cached(discover_func, args, localpath, files[0], cache_path)
+    return discover_func(args, localpath, files)
+
+def get_manifest_cache(args):
+    if args.cache_dir is None:
+        return None
+    cache_path = os.path.join(args.cache_dir, 'manifests')
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    return cache_path
+
+def parse_manifest_file_cached(discover_func, args, localpath, file_path, cache_path):
+    # Products of a manifest file are cached by its content and the parser, without the source
+    # suffix, which is added back for the path the file is found at
+    source_path = file_path
+    if localpath.startswith('/tmp/'):
+        source_path = file_path.replace(localpath+'/','')
+    source = " source:" + source_path
+    key = [MANIFEST_CACHE_VERSION, discover_func.__name__, args.level, args.type, lib_utils.get_file_hash(file_path)]
+    key = hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+    cache_file = os.path.join(cache_path, key[:2], key + '.json')
+    try:
+        with open(cache_file, 'r') as fd:
+            cached = json.load(fd)
+        os.utime(cache_file, None) # mark as recently used
+        plist = [pname + source for pname in cached['products']]
+        p1list = [pname + source for pname in cached['first_level']] if cached['first_level'] is not None else None
+        return plist, p1list
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    result = discover_func(args, localpath, [file_path])
+    if result is None:
+        return None
+    plist, p1list = result
+    for pname in list(plist) + list(p1list or []):
+        if not pname.endswith(source):
+            return result # not cacheable
+    cached = {'products': [pname[:-len(source)] for pname in plist],
+            'first_level': [pname[:-len(source)] for pname in p1list] if p1list is not None else None}
+    try:
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        temp_file = cache_file + '.' + str(os.getpid())
+        with open(temp_file, 'w') as fd:
+            json.dump(cached, fd)
+        os.replace(temp_file, cache_file)
+    except (IOError, OSError) as e:
+        logging.debug("Unable to write manifest cache file [%s]: %s", cache_file, e)
+    return result
 
+def merge_parse_results(results):
+    # Combines the results of the tasks of a type, in task order, as if the files were parsed
+    # by a single call. A product is kept as 1st level if its first occurrence is 1st level.
+    plist = lib_utils.ProductList()
+    p1list = []
+    for result in results:
+        if result is None:
+            return None
+        temp_list, temp1list = result
+        first_level = set(temp1list) if temp1list is not None else set()
+        for pname in temp_list:
+            if plist.add(pname) and pname in first_level:
+                p1list.append(pname)
     return plist, p1list
 
+def discover_types_in_parallel(repo_types, args, localpath):
+    # Returns the discover results for each of the repo_types, in order. Parse tasks of all the
+    # types are handed to a single pool of worker processes.
+    tasks = []
+    task_types = []
+    for repo_type in repo_types:
+        for task in get_parse_tasks(repo_type, args, localpath):
+            tasks.append(task)
+            task_types.append(repo_type)
+    workers = args.inventory_workers
+    if workers == 0:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(tasks))
+    logging.info("Parsing %d manifest files using %d worker processes", len(tasks), workers)
+    pool = multiprocessing.Pool(workers)
+    try:
+        # imap returns results in task order, so the merge does not depend on scheduling
+        type_results = { }
+        for repo_type, result in zip(task_types, pool.imap(run_parse_task, tasks, chunksize=4)):
+            type_results.setdefault(repo_type, []).append(result)
+    finally:
+        pool.close()
+        pool.join()
+    return [merge_parse_results(type_results[repo_type]) for repo_type in repo_types]
+
 def get_last_component(repo_path):
     if repo_path.startswith('http:') or repo_path.startswith('https:'):
         return repo_path.rsplit('/',1)[-1]
@@ -542,13 +882,18 @@ def discover_inventory(args, localpath):
     atype = 'Source Repository'
     plist = []
     asset_tags = []
+    file_index_cache[os.path.abspath(localpath)] = lib_utils.build_file_index(localpath, MANIFEST_FILE_SUFFIXES)
     tech2prod_dict = { }
     shallow_tech2prod_dict = { }
     if args.type is None:
         # If no type is specified, then process all supported types
-        for repo_type in SUPPORTED_TYPES:
-            temp_list, temp1list = discover_specified_type(repo_type, args, localpath)
-            temp_list = list(set(temp_list))
+        if args.inventory_workers != 1:
+            type_results = discover_types_in_parallel(SUPPORTED_TYPES, args, localpath)
+        else:
+            type_results = [discover_specified_type(repo_type, args, localpath) for repo_type in SUPPORTED_TYPES]
+        for repo_type, type_result in zip(SUPPORTED_TYPES, type_results):
+            temp_list, temp1list = type_result
+            temp_list = list(temp_list)
             if temp_list is not None and len(temp_list) > 0:
                 tech2prod_dict[repo_type] = strip_source(temp_list)
                 if temp1list is not None and len(temp1list) > 0:
@@ -556,8 +901,11 @@ def discover_inventory(args, localpath):
                 plist.extend(temp_list)
                 asset_tags.append(repo_type)
     else:
-        plist, p1list = discover_specified_type(args.type, args, localpath)
-        plist = list(set(plist))
+        if args.inventory_workers != 1 and args.type in SUPPORTED_TYPES:
+            plist, p1list = discover_types_in_parallel([args.type], args, localpath)[0]
+        else:
+            plist, p1list = discover_specified_type(args.type, args, localpath)
+        plist = list(plist)
         if plist is not None and len(plist) > 0:
             tech2prod_dict[args.type] = strip_source(plist)
             if p1list is not None and len(p1list) > 0:
@@ -576,14 +924,178 @@ def discover_inventory(args, localpath):
     asset_data['tags'] = asset_tags
     if len(tech2prod_dict) > 0:
         asset_data['compliance_metadata'] = {"source_metadata": {"technology_products":tech2prod_dict, "shallow_technology_products":shallow_tech2prod_dict}}
+    del file_index_cache[os.path.abspath(localpath)]
+    pom_cache.clear() # parsed poms are only shared within a repository
+    if args.cache_dir is not None:
+        lib_utils.prune_cache(get_manifest_cache(args), args.cache_max_age, args.cache_max_size)
     
     return [ asset_data ]
 
+def read_previous_assets(args):
+    previous_assets_file = args.previous_assets
+    if previous_assets_file is None and args.out is not None and os.path.isfile(args.out):
+        previous_assets_file = args.out
+    if previous_assets_file is None:
+        return None
+    try:
+        with open(previous_assets_file, 'r') as fd:
+            return json.load(fd)
+    except (IOError, OSError, ValueError):
+        logging.error("Unable to read previous assets from [%s]", previous_assets_file)
+        return None
+
+def merge_product_lists(new_list, old_list):
+    ret_list = list(new_list)
+    seen = set(ret_list)
+    for pname in old_list:
+        if pname not in seen:
+            seen.add(pname)
+            ret_list.append(pname)
+    return ret_list
+
+def merge_previous_assets(args, assets, path, base_path):
+    # Carry over the products and secrets of unchanged files from the previous run, so the
+    # incremental results of --since describe the complete repository
+    previous_asset = None
+    previous_assets = read_previous_assets(args)
+    if previous_assets is not None:
+        for asset in previous_assets:
+            if asset.get('id') == assets[0]['id']:
+                previous_asset = asset
+                break
+    if previous_asset is None:
+        logging.warning("No previous assets found to merge with. Reporting only changes since [%s]", args.since)
+        return
+
+    changed_files, deleted_files = get_changed_files(args, path)
+    abs_path = os.path.abspath(path)
+    stale_sources = set()
+    stale_filenames = set()
+    for file_path in changed_files | deleted_files:
+        rel_path = file_path[len(abs_path)+1:]
+        stale_sources.add(os.path.join(path, rel_path))
+        stale_sources.add(rel_path)
+        stale_filenames.add(file_path[len(base_path)+1:])
+
+    kept_products = []
+    for pname in previous_asset.get('products', []):
+        index = pname.find(" source:")
+        # products of nested jars have an "outer.jar!/path/inner.jar" source
+        if index != -1 and pname[index+len(" source:"):].split('!/', 1)[0] in stale_sources:
+            continue
+        kept_products.append(pname)
+    assets[0]['products'] = merge_product_lists(assets[0]['products'], kept_products)
+    assets[0]['tags'] = merge_product_lists(assets[0]['tags'], previous_asset.get('tags', []))
+
+    kept_stripped = set(strip_source(kept_products))
+    previous_metadata = previous_asset.get('compliance_metadata', {}).get('source_metadata', {})
+    if 'compliance_metadata' not in assets[0]:
+        assets[0]['compliance_metadata'] = {"source_metadata": {"technology_products": { }, "shallow_technology_products": { }}}
+    source_metadata = assets[0]['compliance_metadata']['source_metadata']
+    for key in ['technology_products', 'shallow_technology_products']:
+        for repo_type, plist in previous_metadata.get(key, {}).items():
+            kept_list = [pname for pname in plist if pname in kept_stripped]
+            source_metadata[key][repo_type] = merge_product_lists(source_metadata[key].get(repo_type, []), kept_list)
+
+    if args.secrets_scan:
+        kept_secrets = []
+        for secret_record in previous_asset.get('secrets', []):
+            if secret_record.get('filename') in stale_filenames:
+                continue
+            if args.secrets_history and 'commit' in secret_record:
+                continue # history is scanned again in full
+            kept_secrets.append(secret_record)
+        assets[0]['secrets'] = assets[0]['secrets'] + kept_secrets
+
 # Note this error routine assumes that the file was read-only and hence could not be deleted
 def on_rm_error( func, path, exc_info):
     os.chmod( path, stat.S_IWRITE )
     os.unlink( path )
 
+def strip_url_credentials(url):
+    # The URL without the user name and password (or token) part
+    parts = urlsplit(url)
+    if '@' not in parts.netloc:
+        return url
+    return urlunsplit((parts.scheme, parts.netloc.rsplit('@', 1)[1], parts.path, parts.query, parts.fragment))
+
+def get_git_mirror(args):
+    # Returns the bare mirror of args.repo kept in the cache directory, fetching the changes since
+    # the last run or cloning it the first time. Credentials in the URL are passed to each fetch
+    # and not stored in the mirror.
+    mirrors_path = os.path.join(args.cache_dir, 'git')
+    if not os.path.isdir(mirrors_path):
+        os.makedirs(mirrors_path)
+    prune_git_mirrors(mirrors_path, args.cache_max_age)
+    repo_url = strip_url_credentials(args.repo)
+    mirror_path = os.path.join(mirrors_path, hashlib.sha256(repo_url.encode('utf-8')).hexdigest() + '.git')
+    fetch_cmd = ['fetch', '--quiet', '--prune', args.repo, '+refs/*:refs/*']
+    if os.path.isdir(mirror_path):
+        logging.info("Fetching changes into cached mirror [%s]", mirror_path)
+        run_git_cmd(mirror_path, fetch_cmd)
+    else:
+        logging.info("Creating cached mirror [%s]", mirror_path)
+        # clone next to the final location, so a failed or concurrent clone never leaves a partial mirror
+        temp_path = tempfile.mkdtemp(dir=mirrors_path)
+        try:
+            # same as clone --mirror, which would store the URL as given in the config
+            run_git_cmd(temp_path, ['init', '--quiet', '--bare'])
+            run_git_cmd(temp_path, ['remote', 'add', '--mirror=fetch', 'origin', repo_url])
+            run_git_cmd(temp_path, fetch_cmd)
+            head = run_git_cmd(temp_path, ['ls-remote', '--symref', args.repo, 'HEAD'])
+            if head.startswith('ref: '):
+                run_git_cmd(temp_path, ['symbolic-ref', 'HEAD', head.split()[1]])
+            os.rename(temp_path, mirror_path)
+        except OSError:
+            if not os.path.isdir(mirror_path):
+                raise
+        finally:
+            if os.path.isdir(temp_path):
+                shutil.rmtree(temp_path, onerror = on_rm_error)
+    os.utime(mirror_path, None) # mark as recently used
+    return mirror_path
+
+def prune_git_mirrors(mirrors_path, max_age):
+    # Removes the mirrors of repositories not scanned in the last max_age days
+    if max_age <= 0:
+        return
+    oldest_allowed = time.time() - max_age * 24 * 60 * 60
+    for entry in os.listdir(mirrors_path):
+        mirror_path = os.path.join(mirrors_path, entry)
+        if entry.endswith('.git') and os.path.getmtime(mirror_path) < oldest_allowed:
+            logging.info("Removing unused cached mirror [%s]", mirror_path)
+            shutil.rmtree(mirror_path, onerror = on_rm_error)
+
+def clone_repo(args, path):
+    # Clones args.repo into path fetching no more than needed. The inventory needs only the manifest
+    # files of the latest commit, secrets / sast scans need the whole tree and --since /
+    # --secrets_history need the history.
+    manifests_only = not args.secrets_scan and not args.sast
+    full_history = args.since is not None or args.secrets_history
+    cmdarr = ['clone', '--quiet']
+    if manifests_only:
+        cmdarr.append('--no-checkout')
+    if args.cache_dir is not None:
+        # objects are borrowed from the local mirror, so there is nothing to gain from a shallow clone
+        cmdarr.extend(['--shared', get_git_mirror(args)])
+    else:
+        if not full_history:
+            cmdarr.extend(['--depth', '1'])
+        if manifests_only:
+            cmdarr.append('--filter=blob:none') # blobs are fetched on checkout of the manifest files
+        cmdarr.append(args.repo)
+    cmdarr.append(path+'/.')
+    run_git_cmd(path, cmdarr)
+    if manifests_only:
+        run_git_cmd(path, ['config', 'core.sparseCheckout', 'true'])
+        info_path = os.path.join(path, '.git', 'info')
+        if not os.path.isdir(info_path):
+            os.makedirs(info_path)
+        with open(os.path.join(info_path, 'sparse-checkout'), 'w') as fd:
+            for suffix in MANIFEST_FILE_SUFFIXES:
+                fd.write('*' + suffix + '\n')
+        run_git_cmd(path, ['read-tree', '-mu', 'HEAD'])
+
 def get_inventory(args):
     path = None
     if args.repo.startswith('http'):
@@ -594,8 +1106,7 @@ def get_inventory(args):
         base_path = path
         new_repo = None
         try:
-            cmdarr = [GIT_PATH, 'clone', args.repo, path+'/.']
-            out = subprocess.check_output(cmdarr)
+            clone_repo(args, path)
         except:
             logging.error(traceback.format_exc())
             logging.error('Error cloning repo locally')
@@ -610,12 +1121,27 @@ def get_inventory(args):
         logging.error('Not a valid repo')
         return None
 
+    changed_files = None
+    if args.since is not None:
+        try:
+            changed_files, deleted_files = get_changed_files(args, path)
+        except (subprocess.CalledProcessError, OSError):
+            logging.error(traceback.format_exc())
+            logging.error("Unable to determine files changed since [%s]", args.since)
+            if args.repo.startswith('http'):
+                shutil.rmtree(path, onerror = on_rm_error)
+            return None
+        logging.info("Found %d changed and %d deleted files since [%s]", len(changed_files), len(deleted_files), args.since)
+
     assets = discover_inventory(args, path)
     if args.secrets_scan:
         logging.info("Discovering secrets/sensitive information. This may take some time.")
-        secret_records = lib_code_secrets.scan_for_secrets(args, path, base_path)
+        secret_records = lib_code_secrets.scan_for_secrets(args, path, base_path, changed_files)
         assets[0]['secrets'] = secret_records
 
+    if args.since is not None:
+        merge_previous_assets(args, assets, path, base_path)
+
     if args.sast:
         logging.info("Performing static analysis. This may take some time.")
         sast_records = sast.run_sast(args, path, base_path)
@@ -628,3 +1154,98 @@ def get_inventory(args):
         logging.warning("No products idenitified nor any code secrets found.")
         return [] # if there are no products nor secrets then no assets to report
     return assets
+
+def read_repo_list(repo_list_file):
+    # One local path or git repo url per line, blank lines and lines starting with '#' are ignored
+    repos = []
+    with open(repo_list_file, 'r') as fd:
+        for line in fd:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            repos.append(line)
+    return repos
+
+def run_repo_worker(args, work_dir, conn):
+    # Runs get_inventory in a worker process of the batch. Temporary files (like clones) are
+    # created in work_dir, which the parent removes even if the worker is killed.
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp() # git and the pools of the scans are killed along with the worker
+    tempfile.tempdir = work_dir
+    try:
+        conn.send((get_inventory(args), None))
+    except Exception:
+        conn.send((None, traceback.format_exc()))
+    conn.close()
+
+def stop_repo_worker(proc):
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    else:
+        proc.terminate()
+    proc.join()
+
+def iter_repo_list_inventory(args):
+    # Yields (repo, assets) for the repositories in --repo_list as their inventory completes, with
+    # assets as None if it failed. Each repository is processed in its own process, up to
+    # --batch_workers at a time, which is killed after --repo_timeout seconds.
+    repos = read_repo_list(args.repo_list)
+    workers = args.batch_workers
+    if workers <= 0:
+        workers = multiprocessing.cpu_count()
+    logging.info("Discovering %d repositories using %d worker processes", len(repos), workers)
+    next_index = 0
+    running = { } # connection -> (repo, process, work directory, start time)
+    try:
+        while next_index < len(repos) or len(running) > 0:
+            while next_index < len(repos) and len(running) < workers:
+                repo_args = copy.copy(args)
+                repo_args.repo = repos[next_index]
+                next_index = next_index + 1
+                work_dir = tempfile.mkdtemp(prefix='twigs_batch_')
+                recv_conn, send_conn = multiprocessing.Pipe(False)
+                proc = multiprocessing.Process(target=run_repo_worker, args=(repo_args, work_dir, send_conn))
+                proc.start()
+                send_conn.close() # so that recv fails if the worker dies without a result
+                running[recv_conn] = (repo_args.repo, proc, work_dir, time.time())
+                logging.info("Started discovery of [%s]", repo_args.repo)
+
+            for conn in multiprocessing.connection.wait(list(running), timeout=1):
+                repo_path, proc, work_dir, start_time = running.pop(conn)
+                try:
+                    assets, error = conn.recv()
+                except EOFError:
+                    proc.join()
+                    assets, error = None, "Worker process exited with code [%s]" % proc.exitcode
+                conn.close()
+                proc.join()
+                shutil.rmtree(work_dir, onerror = on_rm_error)
+                if assets is None:
+                    logging.error("Unable to discover [%s]", repo_path)
+                    if error is not None:
+                        logging.error(error)
+                else:
+                    logging.info("Completed discovery of [%s] in %.1f seconds", repo_path, time.time() - start_time)
+                yield repo_path, assets
+
+            if args.repo_timeout <= 0:
+                continue
+            now = time.time()
+            for conn in list(running):
+                repo_path, proc, work_dir, start_time = running[conn]
+                if now - start_time > args.repo_timeout:
+                    del running[conn]
+                    stop_repo_worker(proc)
+                    conn.close()
+                    shutil.rmtree(work_dir, onerror = on_rm_error)
+                    logging.error("Discovery of [%s] timed out after %d seconds", repo_path, args.repo_timeout)
+                    yield repo_path, None
+    finally:
+        for conn in running:
+            repo_path, proc, work_dir, start_time = running[conn]
+            stop_repo_worker(proc)
+            conn.close()
+            shutil.rmtree(work_dir, onerror = on_rm_error)
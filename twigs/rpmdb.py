@@ -0,0 +1,184 @@
+import os
+import struct
+import logging
+import sqlite3
+from urllib.request import pathname2url
+
+# Reads the name, version, release and arch of the installed packages from the rpm database
+# files directly, without the rpm python bindings. Supported are the BerkeleyDB hash
+# "Packages", the sqlite "rpmdb.sqlite" and the NDB "Packages.db" databases. Nothing is cached
+# or set globally, so databases of different container filesystems can be read concurrently.
+
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_ARCH = 1022
+RPM_STRING_TYPE = 6
+RPM_I18NSTRING_TYPE = 9
+# sanity limits of rpm for the index and data of a header
+HEADER_MAX_INDEX = 0x0000ffff
+HEADER_MAX_DATA = 0x0fffffff
+
+BDB_HASH_MAGIC = 0x061561
+BDB_HASH_UNSORTED_PAGE = 2
+BDB_HASH_PAGE = 13
+BDB_PAGE_HEADER_SIZE = 26
+BDB_KEYDATA_ITEM = 1
+BDB_OFFPAGE_ITEM = 3
+
+NDB_HEADER_MAGIC = 0x506d7052 # 'RpmP'
+NDB_SLOT_MAGIC = 0x746f6c53 # 'Slot'
+NDB_BLOB_MAGIC = 0x53626c42 # 'BlbS'
+NDB_PAGE_SIZE = 4096
+NDB_SLOT_SIZE = 16
+NDB_BLOCK_SIZE = 16
+NDB_HEADER_SIZE = 32
+
+def get_header_string(blob, store, data_len, offset):
+    if offset < 0 or offset >= data_len:
+        return None
+    end = blob.find(b'\0', store + offset, store + data_len)
+    if end == -1:
+        return None
+    return blob[store + offset:end].decode('utf-8', 'replace')
+
+def parse_header_blob(blob):
+    # Returns (name, version, release, arch) from the header blob stored in the database, which
+    # has the index count and data length followed by the index entries and the data
+    if len(blob) < 8:
+        return None
+    index_count, data_len = struct.unpack('>II', blob[:8])
+    if index_count > HEADER_MAX_INDEX or data_len > HEADER_MAX_DATA:
+        return None
+    store = 8 + index_count * 16
+    if store + data_len > len(blob):
+        return None
+    tags = { }
+    for index in range(index_count):
+        tag, tag_type, offset, count = struct.unpack_from('>iIiI', blob, 8 + index * 16)
+        if tag in (RPMTAG_NAME, RPMTAG_VERSION, RPMTAG_RELEASE, RPMTAG_ARCH) and tag_type in (RPM_STRING_TYPE, RPM_I18NSTRING_TYPE):
+            tags[tag] = get_header_string(blob, store, data_len, offset)
+    if tags.get(RPMTAG_NAME) is None:
+        return None
+    # as formatted by rpm for tags which are not present
+    return tuple([tags.get(tag) or '(none)' for tag in (RPMTAG_NAME, RPMTAG_VERSION, RPMTAG_RELEASE, RPMTAG_ARCH)])
+
+def read_bdb_overflow(fd, byte_order, page_size, pgno, total_len):
+    data = []
+    data_len = 0
+    seen = set()
+    while pgno != 0 and data_len < total_len and pgno not in seen:
+        seen.add(pgno) # guard against loops in corrupt files
+        fd.seek(pgno * page_size)
+        page = fd.read(page_size)
+        if len(page) < BDB_PAGE_HEADER_SIZE:
+            break
+        pgno = struct.unpack_from(byte_order + 'I', page, 16)[0]
+        length = struct.unpack_from(byte_order + 'H', page, 22)[0]
+        data.append(page[BDB_PAGE_HEADER_SIZE:BDB_PAGE_HEADER_SIZE + length])
+        data_len = data_len + length
+    return b''.join(data)[:total_len]
+
+def iter_bdb_headers(db_file):
+    # Yields the header blobs stored as values in the BerkeleyDB hash database
+    with open(db_file, 'rb') as fd:
+        meta = fd.read(512)
+        if len(meta) < 72:
+            return
+        for byte_order in ('<', '>'):
+            if struct.unpack_from(byte_order + 'I', meta, 12)[0] == BDB_HASH_MAGIC:
+                break
+        else:
+            logging.warning("Unsupported BerkeleyDB database [%s]", db_file)
+            return
+        if bytearray(meta)[24] != 0:
+            logging.warning("Encrypted BerkeleyDB database [%s] is not supported", db_file)
+            return
+        page_size, = struct.unpack_from(byte_order + 'I', meta, 20)
+        last_pgno, = struct.unpack_from(byte_order + 'I', meta, 32)
+        if page_size < 512 or page_size > 65536:
+            return
+        for pgno in range(1, last_pgno + 1):
+            fd.seek(pgno * page_size)
+            page = fd.read(page_size)
+            if len(page) < page_size:
+                break
+            page_type = bytearray(page[25:26])[0]
+            if page_type != BDB_HASH_PAGE and page_type != BDB_HASH_UNSORTED_PAGE:
+                continue
+            entries, = struct.unpack_from(byte_order + 'H', page, 20)
+            offsets = struct.unpack_from(byte_order + str(entries) + 'H', page, BDB_PAGE_HEADER_SIZE)
+            # entries are key / value pairs, items are stored from the end of the page
+            for index in range(1, entries, 2):
+                offset = offsets[index]
+                if offset >= page_size:
+                    continue
+                item_type = bytearray(page[offset:offset + 1])[0]
+                if item_type == BDB_OFFPAGE_ITEM:
+                    pgno_ovfl, total_len = struct.unpack_from(byte_order + 'II', page, offset + 4)
+                    yield read_bdb_overflow(fd, byte_order, page_size, pgno_ovfl, total_len)
+                elif item_type == BDB_KEYDATA_ITEM:
+                    yield page[offset + 1:offsets[index - 1]]
+
+def iter_sqlite_headers(db_file):
+    conn = sqlite3.connect('file:' + pathname2url(os.path.abspath(db_file)) + '?mode=ro', uri=True)
+    try:
+        for row in conn.execute('SELECT blob FROM Packages ORDER BY hnum'):
+            yield bytes(row[0])
+    finally:
+        conn.close()
+
+def iter_ndb_headers(db_file):
+    # Yields the header blobs of the slots in use of the NDB database, in package index order
+    with open(db_file, 'rb') as fd:
+        header = fd.read(NDB_HEADER_SIZE)
+        if len(header) < NDB_HEADER_SIZE:
+            return
+        magic, version, generation, slot_pages = struct.unpack_from('<IIII', header, 0)
+        if magic != NDB_HEADER_MAGIC or version != 0:
+            logging.warning("Unsupported NDB database [%s]", db_file)
+            return
+        # the sizes are read from the file, nothing past its end is read
+        file_size = os.fstat(fd.fileno()).st_size
+        slots_data = fd.read(max(min(slot_pages * NDB_PAGE_SIZE, file_size) - NDB_HEADER_SIZE, 0))
+        slots = []
+        for offset in range(0, len(slots_data) - NDB_SLOT_SIZE + 1, NDB_SLOT_SIZE):
+            slot_magic, pkg_index, block_offset, block_count = struct.unpack_from('<IIII', slots_data, offset)
+            if slot_magic != NDB_SLOT_MAGIC:
+                break
+            if pkg_index != 0:
+                slots.append((pkg_index, block_offset))
+        slots.sort()
+        for pkg_index, block_offset in slots:
+            fd.seek(block_offset * NDB_BLOCK_SIZE)
+            blob_header = fd.read(16)
+            if len(blob_header) < 16:
+                continue
+            blob_magic, blob_pkg_index, blob_generation, blob_len = struct.unpack('<IIII', blob_header)
+            if blob_magic != NDB_BLOB_MAGIC or blob_pkg_index != pkg_index:
+                continue
+            if block_offset * NDB_BLOCK_SIZE + 16 + blob_len > file_size:
+                continue
+            yield fd.read(blob_len)
+
+RPMDB_FORMATS = [('rpmdb.sqlite', iter_sqlite_headers), ('Packages.db', iter_ndb_headers), ('Packages', iter_bdb_headers)]
+
+def read_packages(dbpath):
+    # Returns the (name, version, release, arch) of the packages in the rpm database in the
+    # dbpath directory, or None if there is no database which could be read
+    for db_name, iter_headers in RPMDB_FORMATS:
+        db_file = os.path.join(dbpath, db_name)
+        if not os.path.isfile(db_file):
+            continue
+        packages = []
+        try:
+            for blob in iter_headers(db_file):
+                package = parse_header_blob(blob)
+                if package is not None:
+                    packages.append(package)
+        except (IOError, OSError, struct.error, sqlite3.Error) as e:
+            logging.warning("Unable to read rpm database [%s]: %s", db_file, e)
+            continue
+        if len(packages) > 0:
+            return packages
+    return None
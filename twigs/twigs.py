@@ -96,6 +96,50 @@ def push_assets_to_TW(assets, args):
             scan_asset_id_list.append(asset_id)
     return asset_id_list, scan_asset_id_list
 
+def discover_repo_list(args):
+    # Assets of the repositories in --repo_list are tagged, exported and pushed as soon as each
+    # repository is discovered, so a batch interrupted midway still has the completed ones
+    assets = []
+    asset_id_list = []
+    scan_asset_id_list = []
+    failed_repos = []
+    out_fd = None
+    if args.out is not None:
+        # the previous output may still be read by --since, so it is replaced only at the end
+        logging.info("Exporting assets to JSON file [%s]", args.out)
+        out_fd = open(args.out + '.partial', 'w')
+        out_fd.write('[')
+    try:
+        for repo_path, repo_assets in repo.iter_repo_list_inventory(args):
+            if repo_assets is None:
+                failed_repos.append(repo_path)
+                continue
+            if len(repo_assets) == 0:
+                continue
+            if args.tag_critical:
+                add_asset_criticality_tag(repo_assets, '5')
+            if args.tag:
+                add_asset_tags(repo_assets, args.tag)
+            for asset in repo_assets:
+                if out_fd is not None:
+                    out_fd.write(',\n' if len(assets) > 0 else '\n')
+                    out_fd.write(json.dumps(asset, indent=2, sort_keys=True))
+                assets.append(asset)
+            if out_fd is not None:
+                out_fd.flush()
+            if args.token is not None and len(args.token) > 0:
+                repo_asset_ids, repo_scan_asset_ids = push_assets_to_TW(repo_assets, args)
+                asset_id_list.extend(repo_asset_ids)
+                scan_asset_id_list.extend(repo_scan_asset_ids)
+    finally:
+        if out_fd is not None:
+            out_fd.write('\n]\n')
+            out_fd.close()
+            os.replace(args.out + '.partial', args.out)
+    if len(failed_repos) > 0:
+        logging.error("Unable to discover %d repositories: %s", len(failed_repos), ', '.join(failed_repos))
+    return assets, asset_id_list, scan_asset_id_list
+
 def run_scan(asset_id_list, pj_json, args):
     if args.no_scan is not True:
         if len(asset_id_list) == 0:
@@ -239,6 +283,9 @@ def main(args=None):
         parser_gcr.add_argument('--repo', help=argparse.SUPPRESS)
         parser_gcr.add_argument('--type', choices=repo.SUPPORTED_TYPES, help=argparse.SUPPRESS)
         parser_gcr.add_argument('--level', help=argparse.SUPPRESS, choices=['shallow','deep'], default='shallow')
+        parser_gcr.add_argument('--inventory_workers', type=int, default=1, help=argparse.SUPPRESS)
+        parser_gcr.add_argument('--since', help=argparse.SUPPRESS)
+        parser_gcr.add_argument('--previous_assets', help=argparse.SUPPRESS)
         parser_gcr.add_argument('--secrets_scan', action='store_true', help=argparse.SUPPRESS)
         parser_gcr.add_argument('--enable_entropy', action='store_true', help=argparse.SUPPRESS)
         parser_gcr.add_argument('--regex_rules_file', help=argparse.SUPPRESS)
@@ -250,6 +297,13 @@ def main(args=None):
         parser_gcr.add_argument('--exclude_patterns_file', help=argparse.SUPPRESS)
         parser_gcr.add_argument('--mask_secret', action='store_true', help=argparse.SUPPRESS)
         parser_gcr.add_argument('--no_code', action='store_true', help=argparse.SUPPRESS)
+        parser_gcr.add_argument('--secrets_workers', type=int, default=1, help=argparse.SUPPRESS)
+        parser_gcr.add_argument('--secrets_history', action='store_true', help=argparse.SUPPRESS)
+        parser_gcr.add_argument('--secrets_max_file_size', type=int, default=0, help=argparse.SUPPRESS)
+        parser_gcr.add_argument('--secrets_large_files', choices=['skip','chunk'], default='skip', help=argparse.SUPPRESS)
+        parser_gcr.add_argument('--cache_dir', help=argparse.SUPPRESS)
+        parser_gcr.add_argument('--cache_max_age', type=int, default=30, help=argparse.SUPPRESS)
+        parser_gcr.add_argument('--cache_max_size', type=int, default=1024, help=argparse.SUPPRESS)
         parser_gcr.add_argument('--sast', action='store_true', help=argparse.SUPPRESS)
 
         # Arguments required for docker discovery 
@@ -263,6 +317,9 @@ def main(args=None):
         parser_docker.add_argument('--repo', help=argparse.SUPPRESS)
         parser_docker.add_argument('--type', choices=repo.SUPPORTED_TYPES, help=argparse.SUPPRESS)
         parser_docker.add_argument('--level', help=argparse.SUPPRESS, choices=['shallow','deep'], default='shallow')
+        parser_docker.add_argument('--inventory_workers', type=int, default=1, help=argparse.SUPPRESS)
+        parser_docker.add_argument('--since', help=argparse.SUPPRESS)
+        parser_docker.add_argument('--previous_assets', help=argparse.SUPPRESS)
         parser_docker.add_argument('--secrets_scan', action='store_true', help=argparse.SUPPRESS)
         parser_docker.add_argument('--enable_entropy', action='store_true', help=argparse.SUPPRESS)
         parser_docker.add_argument('--regex_rules_file', help=argparse.SUPPRESS)
@@ -274,6 +331,13 @@ def main(args=None):
         parser_docker.add_argument('--exclude_patterns_file', help=argparse.SUPPRESS)
         parser_docker.add_argument('--mask_secret', action='store_true', help=argparse.SUPPRESS)
         parser_docker.add_argument('--no_code', action='store_true', help=argparse.SUPPRESS)
+        parser_docker.add_argument('--secrets_workers', type=int, default=1, help=argparse.SUPPRESS)
+        parser_docker.add_argument('--secrets_history', action='store_true', help=argparse.SUPPRESS)
+        parser_docker.add_argument('--secrets_max_file_size', type=int, default=0, help=argparse.SUPPRESS)
+        parser_docker.add_argument('--secrets_large_files', choices=['skip','chunk'], default='skip', help=argparse.SUPPRESS)
+        parser_docker.add_argument('--cache_dir', help='Directory used to cache image layers and parsed manifest files across runs, so that layers and files already seen are not processed again. Caching is disabled if not specified')
+        parser_docker.add_argument('--cache_max_age', type=int, default=30, help='Cache entries not used for these many days are removed. Defaults to 30')
+        parser_docker.add_argument('--cache_max_size', type=int, default=1024, help='Maximum size (in MB) of each cache maintained in the cache directory. Least recently used entries are removed first. Defaults to 1024')
         parser_docker.add_argument('--sast', action='store_true', help=argparse.SUPPRESS)
 
 
@@ -295,11 +359,18 @@ def main(args=None):
 
         # Arguments required for Repo discovery
         parser_repo = subparsers.add_parser ("repo", help = "Discover project repository as asset")
-        parser_repo.add_argument('--repo', help='Local path or git repo url for project', required=True)
+        repo_group = parser_repo.add_mutually_exclusive_group(required=True)
+        repo_group.add_argument('--repo', help='Local path or git repo url for project. Either --repo or --repo_list is required')
+        repo_group.add_argument('--repo_list', help='File with the local paths or git repo urls of the projects to discover, one per line. Each project is discovered as a separate asset')
+        parser_repo.add_argument('--batch_workers', type=int, default=4, help='Number of projects from --repo_list to discover in parallel. Use 0 to use all available CPUs. Defaults to 4')
+        parser_repo.add_argument('--repo_timeout', type=int, default=0, help='Maximum time (in seconds) to discover a project from --repo_list, after which it is skipped. Defaults to 0 (no limit)')
         parser_repo.add_argument('--type', choices=repo.SUPPORTED_TYPES, help='Type of open source component to scan for. Defaults to all supported types if not specified', required=False)
         parser_repo.add_argument('--level', help='Possible values {shallow, deep}. Shallow restricts discovery to 1st level dependencies only. Deep discovers dependencies at all levels. Defaults to shallow discovery if not specified', choices=['shallow','deep'], required=False, default='shallow')
         parser_repo.add_argument('--assetid', help='A unique ID to be assigned to the discovered asset')
         parser_repo.add_argument('--assetname', help='A name/label to be assigned to the discovered asset')
+        parser_repo.add_argument('--inventory_workers', type=int, default=1, help='Number of worker processes to use for parsing manifest files. Use 0 to use all available CPUs. Defaults to 1')
+        parser_repo.add_argument('--since', help='Git commit (or any git revision) to scan changes from. Only files changed since this commit are inventoried and scanned, and results are merged with the previous run')
+        parser_repo.add_argument('--previous_assets', help='JSON file with the assets exported by the previous run, used with --since. Defaults to the file specified with --out, if it exists')
         # Switches related to secrets scan for repo
         parser_repo.add_argument('--secrets_scan', action='store_true', help='Perform a scan to look for secrets in the code')
         parser_repo.add_argument('--enable_entropy', action='store_true', help='Identify entropy based secrets')
@@ -312,6 +383,13 @@ def main(args=None):
         parser_repo.add_argument('--exclude_patterns_file', help='Specify file containing exclude patterns which indicate files to be excluded in the secrets scan. One pattern per line in file.')
         parser_repo.add_argument('--mask_secret', action='store_true', help='Mask identified secret before storing for reference in ThreatWatch.')
         parser_repo.add_argument('--no_code', action='store_true', help='Disable storing code for reference in ThreatWatch.')
+        parser_repo.add_argument('--secrets_history', action='store_true', help='Also scan the files in all commits of the git history for secrets. Findings include the commit')
+        parser_repo.add_argument('--secrets_workers', type=int, default=1, help='Number of worker processes to use for the secrets scan. Use 0 to use all available CPUs. Defaults to 1')
+        parser_repo.add_argument('--secrets_max_file_size', type=int, default=0, help='Files larger than this size (in MB) are handled as per --secrets_large_files in the secrets scan. Defaults to 0 (no limit)')
+        parser_repo.add_argument('--secrets_large_files', choices=['skip','chunk'], default='skip', help='Possible values {skip, chunk}. Skip files larger than --secrets_max_file_size or scan them in chunks with bounded memory. Defaults to skip')
+        parser_repo.add_argument('--cache_dir', help='Directory used to cache scan results, parsed manifest files and mirrors of remote repositories across runs, so that unchanged files are not processed or fetched again. Caching is disabled if not specified')
+        parser_repo.add_argument('--cache_max_age', type=int, default=30, help='Cache entries not used for these many days are removed. Defaults to 30')
+        parser_repo.add_argument('--cache_max_size', type=int, default=1024, help='Maximum size (in MB) of each cache maintained in the cache directory. Least recently used entries are removed first. Defaults to 1024')
         parser_repo.add_argument('--sast', action='store_true', help='Perform static code analysis on your source code')
 
         # Arguments required for File-based discovery
@@ -436,6 +514,10 @@ def main(args=None):
                 logging.error("Error: Invalid cron schedule [%s] specified!" % args.schedule)
                 sys.exit(1)
 
+        if args.mode == 'repo' and args.repo_list is not None and (args.assetid is not None or args.assetname is not None):
+            logging.error('Error: [assetid] and [assetname] arguments cannot be used with [repo_list] argument')
+            sys.exit(1)
+
         assets = []
         sub_pkg_list = ['ssl_audit']
         if args.mode in sub_pkg_list:
@@ -450,6 +532,8 @@ def main(args=None):
             assets = gcr.get_inventory(args)
         elif args.mode == 'servicenow':
             assets = servicenow.get_inventory(args)
+        elif args.mode == 'repo' and args.repo_list is not None:
+            assets, asset_id_list, scan_asset_id_list = discover_repo_list(args)
         elif args.mode == 'repo':
             assets = repo.get_inventory(args)
         elif args.mode == 'host':
@@ -483,17 +567,20 @@ def main(args=None):
                     add_asset_criticiality_tag(assets, args.asset_criticality)
                 """
 
-                if args.tag_critical:
-                    add_asset_criticality_tag(assets, '5')
+                if args.mode == 'repo' and args.repo_list is not None:
+                    pass # already tagged, exported and pushed as each repository completed
+                else:
+                    if args.tag_critical:
+                        add_asset_criticality_tag(assets, '5')
 
-                if args.tag:
-                    add_asset_tags(assets, args.tag)
+                    if args.tag:
+                        add_asset_tags(assets, args.tag)
 
-                if args.out is not None:
-                    export_assets_to_file(assets, args.out)
+                    if args.out is not None:
+                        export_assets_to_file(assets, args.out)
 
-                if args.token is not None and len(args.token) > 0:
-                    asset_id_list, scan_asset_id_list = push_assets_to_TW(assets, args)
+                    if args.token is not None and len(args.token) > 0:
+                        asset_id_list, scan_asset_id_list = push_assets_to_TW(assets, args)
 
                 pj_json = None
                 if args.apply_policy is not None:
@@ -5,9 +5,20 @@ import subprocess
 import paramiko
 import logging
 import requests
+import hashlib
+import time
+import re
+import json
 
 GoDaddyCABundle = True
 
+GIT_PATH = os.environ.get('GIT_PATH')
+if GIT_PATH is None:
+    if os.name == 'nt':
+        GIT_PATH = 'C:\\Program Files\\Git\\cmd\\git.exe'
+    else:
+        GIT_PATH = '/usr/bin/git'
+
 def run_cmd_on_host(args, host, cmdarr, logging_enabled=True):
     if host and host['remote']:
         pkgout = run_remote_ssh_command(args, host, cmdarr[0])
@@ -186,6 +197,36 @@ def get_ip():
         s.close()
     return IP
 
+class ProductList(list):
+    # List of product names with constant time membership checks. add() keeps only the first
+    # occurrence of a name, while append() adds it regardless, like a plain list.
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self.names = set(self)
+
+    def __contains__(self, pname):
+        return pname in self.names
+
+    def add(self, pname):
+        # Returns True if pname was not seen before and has been added
+        if pname in self.names:
+            return False
+        self.names.add(pname)
+        list.append(self, pname)
+        return True
+
+    def append(self, pname):
+        self.names.add(pname)
+        list.append(self, pname)
+
+    def extend(self, pnames):
+        for pname in pnames:
+            self.append(pname)
+
+    def __reduce__(self):
+        # the names set is rebuilt from the list items when unpickled
+        return (self.__class__, (list(self),))
+
 def find_files(localpath, filename):
     ret_files = []
     for root, subdirs, files in os.walk(localpath):
@@ -197,6 +238,178 @@ def find_files(localpath, filename):
                 ret_files.append(file_path)
     return ret_files
 
+def build_file_index(localpath, suffixes):
+    # Walks localpath once and returns the files ending with each of the suffixes, with the
+    # same order and matching as find_files(localpath, suffix). Suffixes must not contain '/'.
+    index = { }
+    for suffix in suffixes:
+        index[suffix] = []
+    suffixes_tuple = tuple(suffixes)
+    for root, subdirs, files in os.walk(localpath):
+        for fname in files:
+            if fname.endswith(suffixes_tuple):
+                file_path = os.path.join(root, fname)
+                for suffix in suffixes:
+                    if fname.endswith(suffix):
+                        index[suffix].append(file_path)
+    return index
+
+JSON_TOKEN_REGEX = re.compile(r'[ \t\n\r]*(?:([\[\]{}:,])|(")|([^ \t\n\r\[\]{}:,"]+))')
+JSON_READ_SIZE = 64 * 1024
+
+def iter_json_tokens(fd):
+    # Yields the tokens of the JSON document read from fd: the structural characters, ('s', string)
+    # and ('v', number / true / false / null). Only the current chunk is held in memory.
+    buf = ''
+    pos = 0
+    eof = False
+    while True:
+        if len(buf) - pos < 64 and not eof:
+            data = fd.read(JSON_READ_SIZE)
+            eof = len(data) == 0
+            buf = buf[pos:] + data
+            pos = 0
+        m = JSON_TOKEN_REGEX.match(buf, pos)
+        if m is None or m.end() == pos:
+            if pos < len(buf) and buf[pos:].strip() != '':
+                raise ValueError("Invalid JSON at [%s]" % buf[pos:pos+20])
+            if eof:
+                return
+            pos = len(buf)
+            continue
+        if m.group(1) is not None:
+            pos = m.end()
+            yield m.group(1)
+        elif m.group(2) is not None:
+            try:
+                value, end = json.decoder.scanstring(buf, m.end())
+            except ValueError:
+                if eof:
+                    raise
+                # string continues in the next chunk
+                data = fd.read(JSON_READ_SIZE)
+                eof = len(data) == 0
+                buf = buf[pos:] + data
+                pos = 0
+                continue
+            pos = end
+            yield ('s', value)
+        else:
+            if m.end() == len(buf) and not eof:
+                # literal may continue in the next chunk
+                data = fd.read(JSON_READ_SIZE)
+                eof = len(data) == 0
+                buf = buf[pos:] + data
+                pos = 0
+                continue
+            pos = m.end()
+            yield ('v', json.loads(m.group(3)))
+
+def read_json_value(tokens, token):
+    # Builds the JSON value starting with token
+    if token == '{':
+        value = { }
+        for key in iter_json_object(tokens):
+            value[key] = read_json_value(tokens, next_json_token(tokens))
+        return value
+    if token == '[':
+        value = []
+        for item_token in iter_json_array(tokens):
+            value.append(read_json_value(tokens, item_token))
+        return value
+    if isinstance(token, tuple):
+        return token[1]
+    raise ValueError("Unexpected JSON token [%s]" % token)
+
+def skip_json_value(tokens, token):
+    # Consumes the JSON value starting with token without building it
+    if token == '{':
+        for key in iter_json_object(tokens):
+            skip_json_value(tokens, next_json_token(tokens))
+    elif token == '[':
+        for item_token in iter_json_array(tokens):
+            skip_json_value(tokens, item_token)
+    elif not isinstance(token, tuple):
+        raise ValueError("Unexpected JSON token [%s]" % token)
+
+def next_json_token(tokens):
+    token = next(tokens, None)
+    if token is None:
+        raise ValueError("Unexpected end of JSON")
+    return token
+
+def iter_json_object(tokens):
+    # Yields the keys of the object whose '{' was just read. The caller has to consume the
+    # value of each key before asking for the next one.
+    token = next_json_token(tokens)
+    if token == '}':
+        return
+    while True:
+        if not isinstance(token, tuple) or token[0] != 's' or next_json_token(tokens) != ':':
+            raise ValueError("Invalid JSON object")
+        yield token[1]
+        token = next_json_token(tokens)
+        if token == '}':
+            return
+        if token != ',':
+            raise ValueError("Invalid JSON object")
+        token = next_json_token(tokens)
+
+def iter_json_array(tokens):
+    # Yields the first token of each item of the array whose '[' was just read
+    token = next_json_token(tokens)
+    if token == ']':
+        return
+    while True:
+        yield token
+        token = next_json_token(tokens)
+        if token == ']':
+            return
+        if token != ',':
+            raise ValueError("Invalid JSON array")
+        token = next_json_token(tokens)
+
+def get_file_hash(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as fd:
+        while True:
+            chunk = fd.read(1024 * 1024)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def prune_cache(cache_path, max_age, max_size):
+    # Remove cache files not used in the last max_age days, then the least recently used
+    # ones till the cache fits in max_size MB. Cache hits are expected to touch the file.
+    entries = []
+    total_size = 0
+    oldest_allowed = time.time() - max_age * 24 * 60 * 60
+    for root, subdirs, files in os.walk(cache_path):
+        for fname in files:
+            file_path = os.path.join(root, fname)
+            try:
+                st = os.stat(file_path)
+                if max_age > 0 and st.st_mtime < oldest_allowed:
+                    os.remove(file_path)
+                    continue
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, file_path))
+            total_size = total_size + st.st_size
+    max_size = max_size * 1024 * 1024
+    if max_size <= 0 or total_size <= max_size:
+        return
+    entries.sort()
+    for mtime, size, file_path in entries:
+        try:
+            os.remove(file_path)
+        except OSError:
+            continue
+        total_size = total_size - size
+        if total_size <= max_size:
+            break
+
 def ascii_string(in_str):
     ascii_str = ''.join([c if ord(c) < 128 else ' ' for c in in_str.strip()])
     return ascii_str